@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This script benchmarks the meetings generation and the infection calculation
+on synthetic configs of a chosen size. A synthetic config is the base config
+(config.yaml) with its civilian box, barracks teams and sotilaskoti scaled
+to the given number of agents and density, and with the given infection
+radius (written to output/benchmarks). Each config is run for a short window
+of fixed steps: first the generation, then the infection upon the generated
+table, each in a fresh worker process, so that its peak memory use is its
+own.
+
+The results (steps and meetings per second from the --profile reports, peak
+memory and table bytes per agent) are appended to
+output/stat_results/benchmarks.csv, hence runs before and after an engine
+change can be compared.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import copy
+from datetime import datetime
+import json
+import multiprocessing
+import numpy as np
+import os
+import resource
+import yaml
+import generate_meetings
+import output_probabilities
+
+# share of conscripts among agents and agents per barracks box, as in the
+# base config (1596 conscripts, 10000 civilians, 38 per box)
+CONSCRIPTS_SHARE = 0.14
+BOX_AGENTS = 38
+
+# barracks teams and their rotation offsets (days)
+TEAMS = {"alpha": 0, "bravo": -14, "charlie": -28}
+
+# gap between boxes, meters
+GAP = 10
+
+# phases of the profile reports which are not a part of the loop steps
+SETUP_PHASES = ("generate_entities", "dump_agents")
+
+
+def parse_args(argv=None):
+    
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--agents', type=int, nargs='+',
+                        default=[1000, 10000, 100000, 1000000],
+                        help='Numbers of agents of the synthetic configs')
+    parser.add_argument('--density', type=float, nargs='+',
+                        default=[6.25e-4],
+                        help='Agents per square meter in all boxes (the \
+                              base config has 6.25e-4)')
+    parser.add_argument('--radius', type=float, nargs='+', default=[2.0],
+                        help='Infection radius values, meters')
+    parser.add_argument('--steps', type=int, default=200,
+                        help='Number of simulation steps to run')
+    parser.add_argument('--base-config', default='config.yaml',
+                        help='Config the synthetic configs are derived from')
+    parser.add_argument('--spatial-engine', default='arrays',
+                        choices=['objects','arrays'],
+                        help='--engine option of generate_meetings.py')
+    parser.add_argument('--spatial-index', default='grid',
+                        choices=['sweep','grid'],
+                        help='--spatial-index option of generate_meetings.py')
+    parser.add_argument('--infection-engine', default='arrays',
+                        choices=['objects','arrays'],
+                        help='--engine option of output_probabilities.py')
+    
+    return parser.parse_args(argv)
+
+
+def synthetic_config(base, n_agents, density, radius, steps):
+    """
+    Args:
+        base: config read from the yaml, its teams are replaced
+        n_agents: number of all agents
+        density: agents per square meter
+        radius: infection radius
+        steps: number of simulation steps
+    Out:
+        config dict
+    """
+    config = copy.deepcopy(base)
+    
+    dt = config["minSimulationStep"]
+    
+    # the generation runs np.arange(0, duration, dt) steps, the duration
+    # half a step short of the window is not rounded up to an extra step
+    days = (steps - 0.5) * dt / (24*60*60)
+    
+    config["simulationDuration"] = days
+    config["outputStatsFor"] = days
+    config["infection"]["radius"] = radius
+    
+    n_boxes = max(round(n_agents * CONSCRIPTS_SHARE / BOX_AGENTS
+                        / len(TEAMS)), 1)
+    
+    n_civilians = n_agents - n_boxes * len(TEAMS) * BOX_AGENTS
+    
+    civ_side = float(np.sqrt(n_civilians / density))
+    box_side = float(np.sqrt(BOX_AGENTS / density))
+    
+    teams = {"civilian": {
+        "conscripted": False,
+        "nAgents": n_civilians,
+        "homeBox": {"width": civ_side, "height": civ_side,
+                    "topLeftPoint": {"x": 0, "y": civ_side}}}}
+    
+    # rows of barracks boxes to the right of the civilian box, one per team
+    for row, (name, offset) in enumerate(TEAMS.items()):
+        
+        teams[name] = {
+            "conscripted": True,
+            "rotationOffset": offset,
+            "nAgents": BOX_AGENTS,
+            "homeBox": {"width": box_side, "height": box_side,
+                        "topLeftPoint": {"x": civ_side + 10*GAP,
+                                         "y": civ_side - row*(box_side+GAP)}},
+            "repeat": {"times": n_boxes,
+                       "spatialSeparation": box_side + GAP}}
+    
+    config["teams"] = teams
+    
+    # the sotilaskoti queue between the civilian box and the barracks
+    sotilaskoti = config["sotilaskoti"]["box"]
+    
+    sotilaskoti["topLeftPoint"] = {"x": civ_side + 4.5*GAP,
+                                   "y": civ_side - 2*GAP}
+    
+    return config
+
+
+def phase_seconds(report):
+    """
+    Out:
+        seconds spent in the loop steps of a --profile report
+    """
+    return sum(phase["seconds"] for name, phase in report["phases"].items()
+               if name not in SETUP_PHASES)
+
+
+def run_generation(config_path, tag, args):
+    """
+    Worker process entry: generate the meetings table of one config.
+    Out:
+        dict with the generation statistics
+    """
+    gen_args = generate_meetings.parse_args([
+        '--no-visual', '--config', config_path, '-n', tag,
+        '--engine', args.spatial_engine,
+        '--spatial-index', args.spatial_index,
+        '--checkpoint-every', '0', '--profile'])
+    
+    _, table_path = generate_meetings.main(gen_args)
+    
+    with open(os.path.join("output", "profiles",
+                           "profile_generate_"+ tag +".json")) as file:
+        report = json.load(file)
+    
+    seconds = phase_seconds(report)
+    
+    return {"table_path"   : table_path,
+            "table_bytes"  : os.path.getsize(table_path),
+            "steps_per_s"  : report["steps"] / seconds,
+            "meets_per_s"  : report["counters"]["records"]["total"] / seconds,
+            "peak_rss_mb"  : peak_rss_mb()}
+
+
+def run_infection(config_path, table_path, tag, args):
+    """
+    Worker process entry: compute the infection upon the generated table.
+    Out:
+        dict with the infection statistics
+    """
+    inf_args = output_probabilities.parse_args([
+        '--config', config_path, '--meet-table', table_path,
+        '--engine', args.infection_engine, '--profile'])
+    
+    # just the calculation, without the plots and summaries
+    output_probabilities.compute_infection([{'config'    : config_path,
+                                             'meet_table': table_path,
+                                             'tag'       : tag}], inf_args)
+    
+    with open(os.path.join("output", "profiles",
+                           "profile_infection_"+ tag +".json")) as file:
+        report = json.load(file)
+    
+    seconds = phase_seconds(report)
+    
+    meetings = report["counters"].get("meetings", {"total": 0})["total"]
+    
+    return {"steps_per_s"  : report["steps"] / seconds,
+            "meets_per_s"  : meetings / seconds,
+            "peak_rss_mb"  : peak_rss_mb()}
+
+
+def peak_rss_mb():
+    
+    # the worker runs a single job, hence its peak is the peak of the job
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # KiB
+
+
+def main(args):
+    
+    with open(args.base_config) as file:
+        base = yaml.load(file, Loader=yaml.FullLoader)
+    
+    # generate_meetings.py copies the config to output/configs itself
+    configs_path = os.path.join("output", "benchmarks")
+    out_stats = os.path.join("output", "stat_results")
+    
+    for path in (configs_path, out_stats):
+        if not os.path.exists(path):
+            os.makedirs(path)
+    
+    results_path = os.path.join(out_stats, "benchmarks.csv")
+    
+    columns = ["date", "agents", "density", "radius", "steps",
+               "spatial_engine", "spatial_index", "infection_engine",
+               "gen_steps_per_s", "gen_meets_per_s", "gen_peak_rss_mb",
+               "table_bytes_per_agent",
+               "inf_steps_per_s", "inf_meets_per_s", "inf_peak_rss_mb"]
+    
+    if not os.path.exists(results_path):
+        with open(results_path, 'w') as file:
+            file.write("\t".join(columns)) # headline of a tab-separated csv
+    
+    # every job runs in a fresh worker process (one at a time, so that the
+    # jobs do not compete for the cores)
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["generate_meetings",
+                                    "output_probabilities"])
+    
+    with ProcessPoolExecutor(1, mp_context=context,
+                             max_tasks_per_child=1) as pool:
+        
+        for n_agents in args.agents:
+            for density in args.density:
+                for radius in args.radius:
+                    
+                    tag = f"bench_{n_agents}_{density:g}_{radius:g}"
+                    
+                    config = synthetic_config(base, n_agents, density,
+                                              radius, args.steps)
+                    
+                    config_path = os.path.join(configs_path,
+                                               "config_"+ tag +".yaml")
+                    
+                    with open(config_path, 'w') as file:
+                        yaml.dump(config, file, sort_keys=False)
+                    
+                    print(f"Benchmark {tag}")
+                    
+                    gen = pool.submit(run_generation, config_path, tag,
+                                      args).result()
+                    
+                    inf = pool.submit(run_infection, config_path,
+                                      gen["table_path"], tag, args).result()
+                    
+                    row = [datetime.now().isoformat(timespec='seconds'),
+                           n_agents, density, radius, args.steps,
+                           args.spatial_engine, args.spatial_index,
+                           args.infection_engine,
+                           f"{gen['steps_per_s']:.2f}",
+                           f"{gen['meets_per_s']:.0f}",
+                           f"{gen['peak_rss_mb']:.0f}",
+                           f"{gen['table_bytes'] / n_agents:.2f}",
+                           f"{inf['steps_per_s']:.2f}",
+                           f"{inf['meets_per_s']:.0f}",
+                           f"{inf['peak_rss_mb']:.0f}"]
+                    
+                    print(", ".join(f"{name}: {value}" for name, value
+                                    in zip(columns[8:], row[8:])))
+                    
+                    with open(results_path, 'a') as file:
+                        file.write("\n" + "\t".join(map(str, row)))
+    
+    print(results_path)
+
+
+if __name__ == "__main__":
+    main(parse_args())
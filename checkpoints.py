@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file contains checkpoints of the meetings generation. A checkpoint is
+one pickle with the whole simulation state at the end of a step (entities,
+sotilaskoti queue, meetings of the step, numpy random generator state and
+the meetings table writer with the offset of its file), from which an
+interrupted generate_meetings.py run can continue (--resume option) as if
+it has never stopped.
+"""
+import glob
+import os
+import pickle
+
+CHECKPOINTS = os.path.join("output", "checkpoints")
+
+
+def checkpoint_path(tag):
+    
+    return os.path.join(CHECKPOINTS, "checkpoint_"+ tag +".pkl")
+
+
+def find_checkpoint(name, timestamped):
+    """
+    Args:
+        name: name tag of the run (-n option)
+        timestamped: the run tags are name_HH:MM:SS (runs without --config)
+    Out:
+        path to the latest checkpoint of the run, or None
+    """
+    if not timestamped:
+        path = checkpoint_path(name)
+        return path if os.path.exists(path) else None
+    
+    paths = glob.glob(checkpoint_path(name +"_*"))
+    
+    return max(paths, key=os.path.getmtime) if paths else None
+
+
+def save_checkpoint(path, checkpoint):
+    """
+    Args:
+        path: path to the checkpoint file
+        checkpoint: dict with the simulation state
+    """
+    if not os.path.exists(CHECKPOINTS):
+        os.makedirs(CHECKPOINTS)
+    
+    # the previous checkpoint is replaced only by a complete one
+    with open(path + ".part", 'wb') as file:
+        pickle.dump(checkpoint, file, protocol=pickle.HIGHEST_PROTOCOL)
+    
+    os.replace(path + ".part", path)
+
+
+def load_checkpoint(path):
+    
+    with open(path, 'rb') as file:
+        return pickle.load(file)
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file contains compression codecs for meeting tables. Tables are
+compressed while they are written (in a background thread, see
+CompressedWriter). A codec compresses data in independent blocks on several
+threads (zlib, bz2 and lzma release the GIL while compressing), the
+compressed blocks are concatenated into one multi-member stream which is
+readable by the standard decompressors. zstd is used only if the optional
+zstandard package is installed; it has its own multi-threaded compressor.
+
+Readers do not need to know the codec, it is detected from the magic bytes
+at the start of the file.
+"""
+import bz2
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import lzma
+import os
+import queue
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# file name extension appended to the .bin table for each codec
+EXTENSIONS = {"none" : "",
+              "gzip" : ".gz",
+              "bz2"  : ".bz2",
+              "lzma" : ".xz",
+              "zstd" : ".zst"}
+
+# magic bytes at the start of compressed files
+MAGICS = {"gzip" : b"\x1f\x8b",
+          "bz2"  : b"BZh",
+          "lzma" : b"\xfd7zXZ\x00",
+          "zstd" : b"\x28\xb5\x2f\xfd"}
+
+# size of independently compressed blocks
+BLOCK_SIZE = 8 * 1024*1024
+
+# marker in the blocks queue which asks for a sync point (see sync)
+SYNC = object()
+
+
+def available_codecs():
+    
+    codecs = ["none", "gzip", "bz2", "lzma"]
+    
+    if zstandard is not None:
+        codecs.append("zstd")
+    
+    return codecs
+
+
+def default_codec():
+    """
+    zstd is the fastest in both directions, gzip is the fastest of the codecs
+    from the standard library.
+    """
+    return "zstd" if zstandard is not None else "gzip"
+
+
+def compress_block(data, codec):
+    
+    if codec == "gzip":
+        return gzip.compress(data, compresslevel=6)
+    if codec == "bz2":
+        return bz2.compress(data)
+    if codec == "lzma":
+        return lzma.compress(data, format=lzma.FORMAT_XZ)
+    
+    raise ValueError(f"Unknown block codec: {codec}")
+
+
+class CompressedWriter():
+    
+    def __init__(self, path, codec, threads=None, queue_blocks=4,
+                 offset=None):
+        """
+        Binary file object (write, close) which compresses the data while it
+        is being written. Written bytes are gathered into blocks, the blocks
+        are handed over to a background thread through a bounded queue (the
+        writing side waits if compression falls behind) and compressed there.
+        The data goes to a path + ".part" file, which is renamed to the path
+        only when the writer is closed without an error. Hence a finished
+        run leaves just the compressed file on disk.
+        - codec is one of available_codecs()
+        - threads is the number of compression threads (default: all cores)
+        - queue_blocks is the number of blocks waiting for compression
+        - offset continues an unfinished .part file: the data after the
+          offset (a sync point, see sync) is dropped and the writing goes on
+          from there. By default a new file is started.
+        """
+        self.path = path
+        self.part_path = path + ".part"
+        self.codec = codec
+        self.threads = threads or os.cpu_count() or 1
+        
+        if offset is None:
+            self.file = open(self.part_path, 'wb')
+        else:
+            self.file = open(self.part_path, 'r+b')
+            self.file.truncate(offset)
+            self.file.seek(offset)
+        
+        self.blocks = queue.Queue(queue_blocks)
+        self.offsets = queue.Queue() # file offsets of reached sync points
+        self.buffer, self.buffered = [], 0
+        
+        self.error = None  # exception raised in the compression thread
+        self.ended = False # end of data has been received by the thread
+        
+        self.thread = threading.Thread(target=self._compress, daemon=True)
+        self.thread.start()
+    
+    def write(self, data):
+        
+        if self.error:
+            raise self.error
+        
+        self.buffer.append(bytes(data))
+        self.buffered += len(data)
+        
+        if self.buffered >= BLOCK_SIZE:
+            self._put_block()
+        
+        return len(data)
+    
+    def _put_block(self):
+        
+        if self.buffer:
+            self.blocks.put(b"".join(self.buffer))
+        
+        self.buffer, self.buffered = [], 0
+    
+    def sync(self):
+        """
+        Write out and compress all data written so far, ending the current
+        compressed member (frame), so that the file up to this point can be
+        decompressed on its own and continued later (see offset).
+        Out:
+            size of the .part file at the sync point
+        """
+        if self.error:
+            raise self.error
+        
+        self._put_block()
+        self.blocks.put(SYNC)
+        
+        offset = self.offsets.get()
+        
+        if offset is None:
+            raise self.error
+        
+        return offset
+    
+    def _synced(self):
+        
+        self.file.flush()
+        
+        self.offsets.put(self.file.tell())
+    
+    def close(self, abort=False):
+        """
+        Wait for the compression to finish. Unless aborted, the .part file
+        is renamed to the final path.
+        """
+        if self.file.closed:
+            return
+        
+        self._put_block()
+        self.blocks.put(None) # end of data
+        self.thread.join()
+        
+        self.file.close()
+        
+        if self.error:
+            raise self.error
+        
+        if not abort:
+            os.replace(self.part_path, self.path)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        # on an error the partial .part file is left for inspection
+        self.close(abort=exc_type is not None)
+    
+    def _compress(self):
+        
+        try:
+            if self.codec == "none":
+                while (block := self._next_block()) is not None:
+                    if block is SYNC:
+                        self._synced()
+                    else:
+                        self.file.write(block)
+            
+            elif self.codec == "zstd":
+                cctx = zstandard.ZstdCompressor(threads=self.threads)
+                
+                with cctx.stream_writer(self.file, closefd=False) as zst:
+                    while (block := self._next_block()) is not None:
+                        if block is SYNC:
+                            zst.flush(zstandard.FLUSH_FRAME)
+                            self._synced()
+                        else:
+                            zst.write(block)
+            else:
+                self._compress_blocks()
+        
+        except BaseException as e:
+            self.error = e
+            
+            # unblock the writing side, the error is raised on next write
+            while not self.ended:
+                if self._next_block() is SYNC:
+                    self.offsets.put(None)
+    
+    def _next_block(self):
+        
+        block = self.blocks.get()
+        
+        if block is None:
+            self.ended = True
+        
+        return block
+    
+    def _compress_blocks(self):
+        """
+        Blocks are compressed independently on a thread pool and written in
+        the original order (a multi-member stream).
+        """
+        with ThreadPoolExecutor(self.threads) as pool:
+            
+            pending = []
+            
+            while (block := self._next_block()) is not None:
+                
+                if block is SYNC:
+                    
+                    for future in pending:
+                        self.file.write(future.result())
+                    
+                    pending = []
+                    
+                    self._synced()
+                    continue
+                
+                pending.append(pool.submit(compress_block, block, self.codec))
+                
+                # keep a bounded number of blocks in memory
+                if len(pending) >= 2*self.threads:
+                    self.file.write(pending.pop(0).result())
+            
+            for future in pending:
+                self.file.write(future.result())
+
+
+def compress_file(src_path, dst_path, codec, threads=None):
+    """
+    Args:
+        src_path: path to the file to compress
+        dst_path: path to the compressed file to create
+        codec: one of available_codecs()
+        threads: number of compression threads (default: all cpu cores)
+    """
+    with open(src_path, 'rb') as src:
+        with CompressedWriter(dst_path, codec, threads) as dst:
+            while block := src.read(BLOCK_SIZE):
+                dst.write(block)
+
+
+def detect_codec(path):
+    
+    with open(path, 'rb') as file:
+        head = file.read(8)
+    
+    for codec, magic in MAGICS.items():
+        if head.startswith(magic):
+            return codec
+    
+    return "none"
+
+
+def open_decompressed(path):
+    """
+    Open a file for binary reading, transparently decompressing it.
+    Out:
+        file object with the decompressed content (a sequential stream)
+    """
+    codec = detect_codec(path)
+    
+    if codec == "gzip":
+        return gzip.open(path, 'rb')
+    if codec == "bz2":
+        return bz2.open(path, 'rb')
+    if codec == "lzma":
+        return lzma.open(path, 'rb')
+    if codec == "zstd":
+        if zstandard is None:
+            raise ImportError(("The zstandard package is required to read"
+                               f" {path}"))
+        return zstandard.ZstdDecompressor().stream_reader(
+            open(path, 'rb'), read_across_frames=True, closefd=True)
+    
+    return open(path, 'rb')
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This script runs an ensemble of replicates of one configuration: the
+meetings generation and the infection calculation repeated with different
+random seeds. Replicates run in a pool of worker processes, each replicate
+gets its own seed derived from one base seed, so the whole ensemble is
+reproducible. The primary statistics of all replicates are summarized as
+means with confidence intervals.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import os
+import generate_meetings
+import output_probabilities
+
+# two-sided 95% quantiles of Student's t distribution for 1..30 degrees of
+# freedom, the normal quantile is used for larger ensembles
+T_975 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262,
+         2.228, 2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101,
+         2.093, 2.086, 2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052,
+         2.048, 2.045, 2.042]
+
+# statistics returned by output_probabilities.process_pair
+METRICS = ["had_disease", "peak_inf", "peak_sympt",
+           "meets_per_day_mil", "meets_per_day_civ"]
+
+
+def parse_args(argv=None):
+    
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', required=True,
+                        help='Path to the configuration file to replicate')
+    parser.add_argument('-n', '--name', required=True,
+                        help='Name tag of the ensemble, replicates are tagged \
+                              as NAME_r000, NAME_r001, ...')
+    parser.add_argument('--replicates', type=int, default=10,
+                        help='Number of replicates (random seeds)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Base seed the replicate seeds are derived from')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='Number of worker processes')
+    parser.add_argument('--spatial-engine', default='arrays',
+                        choices=['objects','arrays'],
+                        help='--engine option of generate_meetings.py')
+    parser.add_argument('--spatial-index', default='grid',
+                        choices=['sweep','grid'],
+                        help='--spatial-index option of generate_meetings.py')
+    parser.add_argument('--infection-engine', default='objects',
+                        choices=['objects','arrays'],
+                        help='--engine option of output_probabilities.py')
+    parser.add_argument('--no-plots', action='store_true',
+                        help='Write the statistics only, without the figures \
+                              (--no-plots option of output_probabilities.py)')
+    
+    return parser.parse_args(argv)
+
+
+def run_replicate(config_path, tag, seed, args):
+    """
+    Generate the meetings table and compute the infection for one replicate.
+    Args:
+        seed: numpy.random.SeedSequence of the replicate
+    Out:
+        dict with the primary statistics of the replicate
+    """
+    # the simulation draws from the global numpy generator
+    np.random.seed(seed.generate_state(4))
+    
+    gen_args = generate_meetings.parse_args([
+        '--no-visual', '--config', config_path, '-n', tag,
+        '--engine', args.spatial_engine,
+        '--spatial-index', args.spatial_index,
+        '--threads', '1'])
+    
+    config_path, table_path = generate_meetings.main(gen_args)
+    
+    # the jobs run in parallel already, the figures of a job are plotted
+    # in its own process
+    inf_args = output_probabilities.parse_args([
+        '--config', config_path, '--meet-table', table_path,
+        '--engine', args.infection_engine, '--fig-workers', '0']
+        + (['--no-plots'] if args.no_plots else []))
+    
+    [stats] = output_probabilities.main(inf_args)
+    
+    return stats
+
+
+def summarize(values):
+    """
+    Out:
+        mean, standard deviation and the half-width of the 95% confidence
+        interval of the mean
+    """
+    values = np.asarray(values, dtype=float)
+    
+    n = len(values)
+    
+    if n < 2:
+        return values.mean(), 0.0, 0.0
+    
+    std = values.std(ddof=1)
+    
+    t = T_975[n-2] if n-1 <= len(T_975) else 1.960
+    
+    return values.mean(), std, t * std / np.sqrt(n)
+
+
+def main(args):
+    
+    # independent seed streams for the replicates
+    seeds = np.random.SeedSequence(args.seed).spawn(args.replicates)
+    
+    tags = [f"{args.name}_r{i:03d}" for i in range(args.replicates)]
+    
+    replicates = []
+    
+    with ProcessPoolExecutor(args.workers) as pool:
+        
+        futures = {pool.submit(run_replicate, args.config, tag, seed, args):
+                   i for i, (tag, seed) in enumerate(zip(tags, seeds))}
+        
+        for future in as_completed(futures):
+            replicates.append((futures[future], future.result()))
+    
+    replicates = [stats for _, stats in sorted(replicates,
+                                               key=lambda r: r[0])]
+    
+    """
+    Save the statistics of each replicate and their summary
+    
+    """
+    out_path = os.path.join("output", "stat_results", args.name)
+    if not os.path.exists(out_path):
+        os.makedirs(out_path)
+    
+    with open(os.path.join(out_path, "ensemble_replicates.csv"), 'w') as file:
+        
+        file.write("\t".join(["tag", "seed"] + METRICS)) # tab-separated
+        
+        for i, stats in enumerate(replicates):
+            
+            values = [str(stats[metric]) for metric in METRICS]
+            
+            file.write("\n" + "\t".join([stats["tag"], f"{args.seed}/{i}"]
+                                        + values))
+    
+    with open(os.path.join(out_path, "ensemble_summary.txt"), 'w') as file:
+        
+        file.write((f"Ensemble of {len(replicates)} replicates of"
+                    f" {args.config} (base seed {args.seed})\n"
+                    f"metric: mean, standard deviation,"
+                    f" 95% confidence interval of the mean\n"))
+        
+        for metric in METRICS:
+            
+            mean, std, ci = summarize([stats[metric] for stats in replicates])
+            
+            file.write((f"\n{metric}: {mean:.6f}, {std:.6f},"
+                        f" [{mean-ci:.6f}, {mean+ci:.6f}]"))
+    
+    print(out_path)
+    
+    return replicates
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -1,11 +1,14 @@
 """
 This file contains classes both for the meetings generation process and for 
-the infection calculation one. The classes Team, Box and SpatialAgent are
+the infection calculation one. The classes Team, Box and SpatialAgent (along
+with its array-backed SpatialState and SpatialAgentView counterparts) are
 needed only at the meetings table genertion phase. The classes InfectionAgent,
 Infection are needed only during the subsequent infection probability 
 clculation from the agent meetings table. 
 """
+from collections import deque
 import numpy as np
+from parameters import compile_config
 
 # teams of conscripts along with a team of civilians with duty = None
 class Team:
@@ -46,12 +49,19 @@ class Box():
 # spatial agent is used during meetings table generation phase
 class SpatialAgent():
     def __init__(self, idx, allowed_box, dx, dy, conscripted,
-                 color=(1.0, 1.0, 1.0, 1.0)):
-        
+                 color=(1.0, 1.0, 1.0, 1.0), x=None, y=None):
+        """
+        - x, y is the spawn position, random within the allowed_box if None
+        """
         self.idx = idx
         
-        self.x = np.random.randint(allowed_box.left, allowed_box.right)
-        self.y = np.random.randint(allowed_box.bottom, allowed_box.top)
+        if x is None:
+            x = np.random.randint(allowed_box.left, allowed_box.right)
+        if y is None:
+            y = np.random.randint(allowed_box.bottom, allowed_box.top)
+        
+        self.x = x
+        self.y = y
         
         self.allowed_box = allowed_box
         
@@ -68,6 +78,109 @@ class SpatialAgent():
         
         self.allowed_box = to_box
 
+# struct-of-arrays storage of spatial agents for the array-backed engine
+class SpatialState():
+    def __init__(self, n_agents):
+        """
+        Positions, velocities and allowed box borders of all agents are kept
+        in numpy arrays indexed by the agent idx. This way the movement update
+        is a single vectorized operation per simulation step instead of a
+        Python loop over the agent objects. Boxes are registered on the first
+        use; box_id holds the position of the agent box in the box_list.
+        """
+        self.x  = np.zeros(n_agents)
+        self.y  = np.zeros(n_agents)
+        self.dx = np.zeros(n_agents)
+        self.dy = np.zeros(n_agents)
+        
+        # allowed box borders of each agent (to bounce agents from)
+        self.left   = np.zeros(n_agents)
+        self.right  = np.zeros(n_agents)
+        self.top    = np.zeros(n_agents)
+        self.bottom = np.zeros(n_agents)
+        
+        self.box_id  = np.zeros(n_agents, dtype=np.int32)
+        self.box_list = []     # Box instances, position in list is the box id
+        self.box_ids  = dict() # key: box name, val: box id
+        
+        # x-ordering of agents as a permutation of agent idxs (kept by
+        # the sorting functions), and the number of agents teleported since
+        # the last sort which tells how disordered the permutation may be
+        self.order = np.arange(n_agents)
+        self.n_transferred = 0
+    
+    def register_box(self, box):
+        
+        if box.name not in self.box_ids:
+            self.box_ids[box.name] = len(self.box_list)
+            self.box_list.append(box)
+        
+        return self.box_ids[box.name]
+    
+    def set_box(self, idx, box):
+        
+        self.box_id[idx] = self.register_box(box)
+        
+        self.n_transferred += 1
+        
+        self.left[idx]   = box.left
+        self.right[idx]  = box.right
+        self.top[idx]    = box.top
+        self.bottom[idx] = box.bottom
+
+# spatial agent which reads and writes its attributes from a SpatialState
+class SpatialAgentView(SpatialAgent):
+    def __init__(self, idx, allowed_box, dx, dy, conscripted, state,
+                 color=(1.0, 1.0, 1.0, 1.0), x=None, y=None):
+        """
+        The view keeps the SpatialAgent interface (e.g. for visualization,
+        team transfers and the pickled agents dump), while positions,
+        velocities and boxes are stored in the shared state arrays.
+        """
+        self.state = state
+        
+        super().__init__(idx, allowed_box, dx, dy, conscripted, color, x, y)
+    
+    @property
+    def x(self):
+        return self.state.x[self.idx]
+    
+    @x.setter
+    def x(self, value):
+        self.state.x[self.idx] = value
+    
+    @property
+    def y(self):
+        return self.state.y[self.idx]
+    
+    @y.setter
+    def y(self, value):
+        self.state.y[self.idx] = value
+    
+    @property
+    def dx(self):
+        return self.state.dx[self.idx]
+    
+    @dx.setter
+    def dx(self, value):
+        self.state.dx[self.idx] = value
+    
+    @property
+    def dy(self):
+        return self.state.dy[self.idx]
+    
+    @dy.setter
+    def dy(self, value):
+        self.state.dy[self.idx] = value
+    
+    @property
+    def allowed_box(self):
+        return self.state.box_list[self.state.box_id[self.idx]]
+    
+    @allowed_box.setter
+    def allowed_box(self, box):
+        self.state.set_box(self.idx, box)
+
 class InfectionAgent():
     
     def __init__(self, idx, conscripted, infection, meets_dropout):
@@ -105,15 +218,16 @@ def init_infect(agents, config):
         inf_ts = np.random.uniform(-inf_dur, 0)
         
         # flush 'init' incubation and infection and probability parts
-        agent.infection.parts_inc[inc_ts] = inc_frac
-        agent.infection.parts_inf[inf_ts] = inf_frac
+        agent.infection.add_bit('inc', inc_ts, inc_frac)
+        agent.infection.add_bit('inf', inf_ts, inf_frac)
 
 class Infection():
     
     def __init__(self, inc_dur, psy_dur, inf_dur, asymt_p, 
                  mask_p, quar_s_p, quar_x_p,
                  incub_trx, psymt_trx, sympt_trx, asymt_trx,
-                 mask_eff_tx, mask_eff_rx, quar_eff):
+                 mask_eff_tx, mask_eff_rx, quar_eff, merge_within=0.0,
+                 contact_secs=0.0):
         
         # incubation, pre-symptomatic, and infection period durations, seconds
         self.inc_dur = inc_dur * 24*60*60
@@ -121,11 +235,31 @@ class Infection():
         self.inf_dur = inf_dur * 24*60*60
         
         # small bits of infection yielded from meetings with another agents
-        # incubation bits transition to infection when the time comes
-        self.parts_inc = dict() #
-        self.parts_psy = dict() #
-        self.parts_inf = dict() #
-        self.parts_imm = dict() # key:timestamp, val: p (probability)
+        # incubation bits transition to infection when the time comes.
+        # Bits are (timestamp, p (probability)) tuples ordered by timestamp:
+        # meetings come in time order and stage durations are per agent, so
+        # bits also leave each stage in this order
+        self.parts_inc = deque() #
+        self.parts_psy = deque() #
+        self.parts_inf = deque() #
+        self.parts_imm = deque() #
+        
+        # running totals of the parts above, kept up to date by add_bit and
+        # pop_bit, so that the stage probabilities are not summed up again
+        # on every meeting
+        self.inc_p = 0.0
+        self.psy_p = 0.0
+        self.inf_p = 0.0
+        self.imm_p = 0.0
+        
+        # bits with timestamps within the same merge_within seconds window
+        # are merged into one part (0 keeps every timestamp separately)
+        self.merge_within = merge_within
+        
+        # duration of a contact the transfer probabilities are given for,
+        # contacts of known duration transfer accordingly more or less
+        # (0 transfers the same per contact whatever its duration)
+        self.contact_secs = contact_secs
         
         # infection transfer probabilities for incubating and acute stages
         self.incub_trx  =  incub_trx
@@ -145,16 +279,60 @@ class Infection():
         self.mask_eff_tx = mask_eff_tx # from   this infection to another
         self.mask_eff_rx = mask_eff_rx # from   another infection to this
         self.quar_eff = quar_eff
+    
+    def add_bit(self, stage, ts, p):
+        """
+        Add an infection bit to a stage ('inc', 'psy', 'inf' or 'imm').
+        Without merging, a bit with the timestamp of the last bit replaces
+        it (a timestamp can only repeat at the end, as bits are ordered).
+        """
+        parts = getattr(self, 'parts_' + stage)
+        total = getattr(self, stage + '_p')
+        
+        if self.merge_within:
+            ts -= ts % self.merge_within
+        
+        if parts and parts[-1][0] == ts:
+            
+            _, p_last = parts.pop()
+            
+            total -= p_last
+            
+            if self.merge_within:
+                p += p_last
+        
+        parts.append((ts, p))
+        
+        setattr(self, stage + '_p', total + p)
+    
+    def pop_bit(self, stage):
+        """
+        Remove the earliest bit of a stage.
+        Out:
+            (timestamp, p) tuple
+        """
+        parts = getattr(self, 'parts_' + stage)
+        
+        ts, p = parts.popleft()
         
-    def transfer(self, eval_time, met_agent): # call for each other
+        # reset the total of an empty stage to avoid rounding drift
+        if parts:
+            setattr(self, stage + '_p', getattr(self, stage + '_p') - p)
+        else:
+            setattr(self, stage + '_p', 0.0)
+        
+        return ts, p
+    
+    # call for each other
+    def transfer(self, eval_time, met_agent, duration=None):
         
         met_inf = met_agent.infection
         
         # total probabilities for agent to be incubating or acute infected
         # are sums of 'infection bits' transferred to this agent over time
-        inc_p = sum(self.parts_inc.values())
-        psy_p = sum(self.parts_psy.values())
-        inf_p = sum(self.parts_inf.values())
+        inc_p = self.inc_p
+        psy_p = self.psy_p
+        inf_p = self.inf_p
         
         # mask wearing modifiers. Chance that there is no mask at all, 
         # plus chance that mask passes infection.
@@ -193,10 +371,10 @@ class Infection():
         met_mask_mod  = met_nomask_p + met_mask_pass
         
         # transferred infection decreases p of other party being healthy
-        met_inc_p = sum(met_inf.parts_inc.values()) # incubating
-        met_psy_p = sum(met_inf.parts_psy.values()) # pre-symptomatic
-        met_inf_p = sum(met_inf.parts_inf.values()) # acute infection
-        met_imm_p = sum(met_inf.parts_imm.values()) # immune
+        met_inc_p = met_inf.inc_p # incubating
+        met_psy_p = met_inf.psy_p # pre-symptomatic
+        met_inf_p = met_inf.inf_p # acute infection
+        met_imm_p = met_inf.imm_p # immune
         
         met_hlty_p = 1 - (met_inc_p + met_psy_p + met_inf_p + met_imm_p)
         
@@ -204,8 +382,18 @@ class Infection():
         
         p_recv = p_disp * met_hlty_p * met_mask_mod
         
+        # a contact lasting several reference contacts (see contact_secs)
+        # is their sequence: the infection passes unless it misses each time
+        if self.contact_secs and duration is not None:
+            
+            p_pass = min(p_disp * met_mask_mod, 1.0)
+            
+            n_contacts = duration / self.contact_secs
+            
+            p_recv = met_hlty_p * -np.expm1(n_contacts * np.log1p(-p_pass))
+        
         # add an appropriate incubation probability to the other agent
-        met_inf.parts_inc[eval_time] = p_recv
+        met_inf.add_bit('inc', eval_time, p_recv)
         
         # record statistics
         met_agent.infection_transmitted += p_recv
@@ -226,76 +414,392 @@ class Infection():
             else:
                 self.mask_p = config['mask']['coverage']['military']
         
+        self.develop(eval_time)
+    
+    def develop(self, eval_time):
+        """
+        Move the bits whose stages have ended by eval_time to the next
+        stages. Called on every meeting (see update), and for all agents
+        before a daily record, so that agents without meetings of late are
+        recorded as of the current time too.
+        """
         """
         1) Transfer developed incubation parts to pre-symptomatic ones
     
         """
-        inc_ts = self.parts_inc.keys() # incubation start timestamps
-        
-        inc_ts = list(inc_ts) # detach from dict (to rm items during iteration)
-        
-        for inc_t in inc_ts:
+        # the earliest bits develop first, so only the queue fronts are checked
+        while self.parts_inc:
+            
+            inc_t = self.parts_inc[0][0] # incubation start timestamp
             
             inc_end = inc_t + self.inc_dur # incubation period end
             
-            if eval_time > inc_end:
-                
-                dev_psy = self.parts_inc.pop(inc_t) # developed infection
-                                                    # probability bit
-                self.parts_psy[inc_end] = dev_psy
+            if eval_time <= inc_end:
+                break
+            
+            _, dev_psy = self.pop_bit('inc') # developed infection
+                                             # probability bit
+            self.add_bit('psy', inc_end, dev_psy)
         
         """
         2) Transfer developed pre-symptomatic parts to infection ones
     
         """
-        psy_ts = self.parts_psy.keys()
+        while self.parts_psy:
+            
+            psy_end = self.parts_psy[0][0] + self.psy_dur
+            
+            if eval_time <= psy_end:
+                break
+            
+            _, dev_psy = self.pop_bit('psy')
+            
+            self.add_bit('inf', psy_end, dev_psy)
+        
+        """
+        2) Transfer developed infection parts to immunity ones
+    
+        """
+        while self.parts_inf:
+            
+            inf_end = self.parts_inf[0][0] + self.inf_dur
+            
+            if eval_time <= inf_end:
+                break
+            
+            _, imm_inf = self.pop_bit('inf') # immunity after recovery
+                                             # probability bit
+            self.add_bit('imm', inf_end, imm_inf)
+        
+
+# vectorized counterpart of the InfectionAgent / Infection objects
+class InfectionArrays():
+    
+    # places where conscripts wear masks as civilians do
+    CIVILIAN_PLACES = ('civilian', 'sotilaskoti')
+    
+    def __init__(self, scenarios, bucket=3600):
+        """
+        Stage probabilities of all agents are kept in numpy arrays. Meetings
+        of a timestep are processed at once with vectorized gathers and
+        scatter-adds instead of the Infection.update / transfer calls per
+        meeting and per agent.
+        
+        Several scenarios (infection parameter sets) upon the same meetings
+        can be evolved together. Arrays are then laid out scenario by
+        scenario: agent idx of scenario k is at k*n + idx, and each meeting
+        is applied to every scenario.
+        
+        Instead of the dicts with "probability bits" keyed by timestamps,
+        each stage has a ring buffer of time buckets (rows) per agent
+        (columns). A bit is put into the bucket of its stage end, and when
+        the simulation time passes that bucket, the whole row is moved to the
+        next stage at once. Stage ends are rounded to the bucket size.
+        
+        - scenarios is a list of (agents, config) tuples, where agents is a
+          list of InfectionAgent instances (after init_infect), their
+          per-agent parameters and initial infection bits are copied. All
+          scenarios must have the same number of agents.
+        - bucket is the time bucket size in seconds
+        """
+        self.k = len(scenarios) # number of scenarios
+        self.n = len(scenarios[0][0]) # agents per scenario
+        
+        if any(len(agents) != self.n for agents, _ in scenarios):
+            raise ValueError("Scenarios differ in the number of agents")
+        
+        agents = [agent for agents, _ in scenarios for agent in agents]
+        
+        n = len(agents)
+        
+        self.bucket = bucket
+        
+        def collect(attr, source='infection'):
+            if source == 'infection':
+                values = [getattr(agent.infection, attr) for agent in agents]
+            else:
+                values = [getattr(agent, attr) for agent in agents]
+            return np.array(values, dtype=float)
+        
+        self.conscripted = collect('conscripted', 'agent').astype(bool)
+        self.meets_dropout = collect('meets_dropout', 'agent')
+        
+        # mask coverage of conscripts in civilian and military places
+        coverage = [config['mask']['coverage'] for _, config in scenarios]
+        
+        self.cov_civ = np.repeat([c['civilian'] for c in coverage], self.n)
+        self.cov_mil = np.repeat([c['military'] for c in coverage], self.n)
+        
+        for attr in ('asymt_p', 'mask_p', 'quar_x_p', 'quar_s_p', 'quar_eff',
+                     'incub_trx', 'psymt_trx', 'sympt_trx', 'asymt_trx',
+                     'mask_eff_tx', 'mask_eff_rx', 'contact_secs'):
+            setattr(self, attr, collect(attr))
+        
+        # stage durations in buckets
+        self.d_inc = np.rint(collect('inc_dur') / bucket).astype(np.int64)
+        self.d_psy = np.rint(collect('psy_dur') / bucket).astype(np.int64)
+        self.d_inf = np.rint(collect('inf_dur') / bucket).astype(np.int64)
+        
+        # ring buffers, long enough to never wrap onto pending buckets
+        self.ring_inc = np.zeros((self.d_inc.max() + 2, n))
+        self.ring_psy = np.zeros((self.d_psy.max() + 2, n))
+        self.ring_inf = np.zeros((self.d_inf.max() + 2, n))
+        
+        # stage totals
+        self.inc_p = np.zeros(n)
+        self.psy_p = np.zeros(n)
+        self.inf_p = np.zeros(n)
+        self.imm_p = np.zeros(n)
+        
+        # last processed bucket
+        self.curr = -1
+        
+        self._civ_places = np.zeros(0, dtype=bool)
+        
+        # collect some statistics on-the-fly
+        self.infection_transmitted = np.zeros(n)
+        self.meetings_n = np.zeros(n, dtype=np.int64)
+        
+        # initial infection bits (see init_infect)
+        for idx, agent in enumerate(agents):
+            for t, p in agent.infection.parts_inc:
+                self.add_bits('inc', np.array([idx]), t, np.array([p]))
+            for t, p in agent.infection.parts_inf:
+                self.add_bits('inf', np.array([idx]), t, np.array([p]))
+    
+    def add_bits(self, stage, idx, start, p):
+        """
+        Add probability bits p to agents idx, in the stage which started at
+        the start time (seconds) and ends after the agent stage duration.
+        """
+        ring, d, total = {
+            'inc': (self.ring_inc, self.d_inc, self.inc_p),
+            'psy': (self.ring_psy, self.d_psy, self.psy_p),
+            'inf': (self.ring_inf, self.d_inf, self.inf_p)}[stage]
+        
+        end = np.floor(start / self.bucket).astype(np.int64) + d[idx]
         
-        psy_ts = list(psy_ts)
+        # bits which should have already ended are moved on the next bucket
+        end = np.maximum(end, self.curr + 1)
         
-        for psy_t in psy_ts:
+        np.add.at(ring, (end % len(ring), idx), p)
+        np.add.at(total, idx, p)
+    
+    def advance(self, eval_time):
+        """
+        Transfer developed bits to the next stages for all buckets up to the
+        current one: incubation -> pre-symptomatic -> infection -> immunity.
+        """
+        now = int(eval_time // self.bucket)
+        
+        for b in range(self.curr + 1, now + 1):
             
-            psy_end = psy_t + self.psy_dur
+            self.curr = b
             
-            if eval_time > psy_end:
+            for ring, total, next_stage in (
+                    (self.ring_inc, self.inc_p, 'psy'),
+                    (self.ring_psy, self.psy_p, 'inf'),
+                    (self.ring_inf, self.inf_p, 'imm')):
                 
-                dev_psy = self.parts_psy.pop(psy_t)
+                row = ring[b % len(ring)]
                 
-                self.parts_inf[psy_end] = dev_psy
-        
+                idx = np.flatnonzero(row)
+                
+                if not len(idx):
+                    continue
+                
+                dev = row[idx]
+                row[idx] = 0.0
+                
+                total[idx] -= dev
+                
+                if next_stage == 'imm':
+                    self.imm_p[idx] += dev
+                else:
+                    self.add_bits(next_stage, idx, b * self.bucket, dev)
+    
+    def dispatched(self, idx, mask_p):
         """
-        2) Transfer developed infection parts to immunity ones
+        Total "outgoing" probability of infecting the other party for agents
+        idx (see Infection.transfer).
+        """
+        mask_mod = (1 - mask_p) + mask_p * (1 - self.mask_eff_tx[idx])
+        
+        quar_x_mod = (1 - self.quar_x_p[idx]) + (self.quar_x_p[idx]
+                                                 * (1 - self.quar_eff[idx]))
+        quar_s_mod = (1 - self.quar_s_p[idx]) + (self.quar_s_p[idx]
+                                                 * (1 - self.quar_eff[idx]))
+        
+        asymt_p = self.asymt_p[idx]
+        inf_p   = self.inf_p[idx]
+        
+        p_hidden = (self.inc_p[idx] * self.incub_trx[idx]
+                  + self.psy_p[idx] * self.psymt_trx[idx]
+                  + inf_p * asymt_p * self.asymt_trx[idx])
+        
+        p_sympt = inf_p * (1 - asymt_p) * self.sympt_trx[idx]
+        
+        return p_hidden * mask_mod * quar_x_mod + p_sympt * quar_s_mod
     
+    def meet(self, eval_time, agent_a, agent_b, place, places,
+             duration=None, rand=np.random.rand):
+        """
+        Process all meetings of one timestep.
+        Args:
+            eval_time: timestamp of the meetings
+            agent_a, agent_b: arrays with agent idxs of meeting links
+            place: array with place ids of the meetings
+            places: list with place names, place ids index into it
+            duration: array with contact durations in seconds (interval
+                      tables), None counts each meeting as one contact
+            rand: random numbers generator, rand(n) -> uniform floats
         """
-        inf_ts = self.parts_inf.keys()
+        self.advance(eval_time)
         
-        inf_ts = list(inf_ts)
+        civ_places = self.civ_places(places)
         
-        for inf_t in inf_ts:
+        # the same meetings in every scenario
+        if self.k > 1:
+            offsets = np.arange(self.k)[:, None] * self.n
             
-            inf_end = inf_t + self.inf_dur
+            agent_a = (offsets + agent_a).ravel()
+            agent_b = (offsets + agent_b).ravel()
+            place   = np.tile(place, self.k)
             
-            if eval_time > inf_end:
-                
-                imm_inf = self.parts_inf.pop(inf_t) # immunity after recovery
-                                                    # probability bit
-                self.parts_imm[inf_end] = imm_inf
+            if duration is not None:
+                duration = np.tile(duration, self.k)
+        
+        # fraction of meetings excluded from infection transmission
+        keep = rand(len(agent_a)) > self.meets_dropout[agent_a]
+        
+        agent_a, agent_b = agent_a[keep], agent_b[keep]
+        place = place[keep]
+        
+        if duration is not None:
+            duration = duration[keep]
+        
+        if not len(agent_a):
+            return
+        
+        # dynamic mask usage based on the area where conscripts meet
+        mil_mask = np.where(civ_places[place], self.cov_civ[agent_a],
+                                               self.cov_mil[agent_a])
+        
+        mask_a = np.where(self.conscripted[agent_a], mil_mask,
+                          self.mask_p[agent_a])
+        mask_b = np.where(self.conscripted[agent_b], mil_mask,
+                          self.mask_p[agent_b])
+        
+        # both directions of each meeting at once
+        src  = np.concatenate((agent_a, agent_b))
+        dst  = np.concatenate((agent_b, agent_a))
+        mask_src = np.concatenate((mask_a, mask_b))
+        mask_dst = np.concatenate((mask_b, mask_a))
+        
+        p_disp = self.dispatched(src, mask_src)
+        
+        dst_mask_mod = (1 - mask_dst) + mask_dst * (1 - self.mask_eff_rx[dst])
+        
+        p_pass = np.clip(p_disp * dst_mask_mod, 0.0, 1.0)
+        
+        # several meetings of one agent within a step are combined as
+        # independent chances: 1 - prod(1 - p)
+        uniq, inv = np.unique(dst, return_inverse=True)
+        
+        log_miss_each = np.log1p(-p_pass)
+        
+        # contacts lasting several reference contacts miss several times
+        # (see Infection.transfer)
+        if duration is not None:
+            
+            contact_secs = self.contact_secs[dst]
+            
+            n_contacts = np.concatenate((duration, duration)) / np.where(
+                contact_secs > 0, contact_secs, 1.0)
+            
+            log_miss_each *= np.where(contact_secs > 0, n_contacts, 1.0)
+        
+        log_miss = np.bincount(inv, weights=log_miss_each,
+                               minlength=len(uniq))
+        
+        hlty_p = 1 - (self.inc_p[uniq] + self.psy_p[uniq]
+                      + self.inf_p[uniq] + self.imm_p[uniq])
+        
+        p_recv = np.clip(hlty_p, 0.0, 1.0) * -np.expm1(log_miss)
+        
+        self.add_bits('inc', uniq, eval_time, p_recv)
+        
+        # record statistics (as Infection.transfer does, on the receiver)
+        self.infection_transmitted[uniq] += p_recv
+        
+        np.add.at(self.meetings_n, agent_a, 1)
+        np.add.at(self.meetings_n, agent_b, 1)
+    
+    def civ_places(self, places):
+        """
+        Out:
+            boolean array over place ids, True where conscripts wear masks
+            with the civilian coverage
+        """
+        # places dictionaries only grow, so the array is rebuilt on change
+        if len(places) != len(self._civ_places):
+            self._civ_places = np.array([name in self.CIVILIAN_PLACES
+                                         for name in places], dtype=bool)
+        
+        return self._civ_places
+    
+    def scenario(self, values, k):
+        """
+        Out:
+            view of a per-agent array (e.g. inf_p) for the scenario k
+        """
+        return values[k*self.n:(k+1)*self.n]
+    
+    def store_stats(self, agents, k=0):
+        """
+        Copy the on-the-fly statistics of the scenario k to its
+        InfectionAgent instances.
+        """
+        transmitted = self.scenario(self.infection_transmitted, k)
+        meetings_n  = self.scenario(self.meetings_n, k)
         
+        for idx, agent in enumerate(agents):
+            agent.infection_transmitted = transmitted[idx]
+            agent.meetings_n = meetings_n[idx]
 
-def generate_spatial_entities(config):
+
+def generate_spatial_entities(config, engine="objects"):
+    """
+    Args:
+        config: config read from the yaml
+        engine: "objects" keeps agent attributes in SpatialAgent instances,
+                "arrays" keeps them in a SpatialState (struct of arrays)
+                and returns SpatialAgentView instances as agents
+    Out:
+        teams, boxes, agents, state (state is None for the "objects" engine)
+    """
+    params = compile_config(config)
     
     teams, boxes, agents = [], {}, []
     
+    if engine == "arrays":
+        state = SpatialState(params.n_agents)
+    else:
+        state = None
+    
+    # scale distance covered per simulation step 
+    T  = 24*60*60 # seconds in day
+    
+    n_steps = T/params.dt # simulation steps per day
+    
     idx = 0 # global agents ids counter
     
     # each team has a home box and some number of agents to spawn
-    for team_name, team_conf in config["teams"].items():
+    for team_conf in params.teams:
         
         # team with the same parameters may be
         # repeated several times in separate boxes
-        
-        reps = team_conf.get('repeat',  # if repeats do not exist:
-                             {'times': 1, 'spatialSeparation' : 0})
-        times = reps['times']
+        times = team_conf.times
         
         for rep in range(times):
             
@@ -306,67 +810,52 @@ def generate_spatial_entities(config):
                 suffix = ''
             
             # build boxes
-            box_name = f"{team_name}{suffix}"
-            
-            w = eval(str(team_conf['homeBox'][ 'width']))
-            h = eval(str(team_conf['homeBox']['height']))
+            box_name = f"{team_conf.name}{suffix}"
             
-            x = eval(str(team_conf['homeBox']['topLeftPoint']['x']))
-            y = eval(str(team_conf['homeBox']['topLeftPoint']['y']))
+            topLeftPoint = {'x': team_conf.x + rep * team_conf.separation,
+                            'y': team_conf.y}
             
-            sep = eval(str(reps['spatialSeparation']))
+            box = Box(box_name, team_conf.width, team_conf.height,
+                      topLeftPoint)
             
-            x += rep * sep
-            
-            topLeftPoint = {'x': x, 'y': y}
+            boxes[box_name] = box                    
             
-            box = Box(box_name, w, h, topLeftPoint)
+            # populate agents, random attributes are drawn for the whole team
+            n = team_conf.n_agents
             
-            boxes[box_name] = box                    
+            # random agents velocity amplitude (normal distribution), scaled
+            # according to the number of simulation steps
+            A = np.random.normal(params.speed_mu, params.speed_sigma, n)
+            A = A / n_steps
             
-            # populate agents
-            team_agent_ids = []
+            # random angle (uniform distribution)
+            phi = np.random.uniform(0, 2*np.pi, n)
             
-            # random agents velocity (normal distribution)
-            mu    = eval(str(config["movementSpeed"]["mu"]        ))
-            sigma = eval(str(config["movementSpeed"]["sigma"] * mu))
+            # polar -> Carthesian
+            dx = A*np.cos(phi)
+            dy = A*np.sin(phi)
             
-            # scale distance covered per simulation step 
-            T  = 24*60*60                               # seconds in day
-            dt = eval(str(config["minSimulationStep"])) # seconds in sim step
+            # random spawn positions within the box
+            x = np.random.randint(box.left, box.right, n)
+            y = np.random.randint(box.bottom, box.top, n)
             
-            n_steps = T/dt # simulation steps per day
+            team_agent_ids = list(range(idx, idx + n))
             
-            for _ in range(team_conf["nAgents"]):
-                      
-                # velocity vector amplitude
-                A = np.random.normal(mu, sigma)
+            for i in range(n):
                 
-                # scale according to the number of simulation steps
-                A = A / n_steps
-                
-                # random angle (uniform distribution)
-                phi = np.random.uniform(0, 2*np.pi)
-                
-                # polar -> Carthesian
-                dx = A*np.cos(phi)
-                dy = A*np.sin(phi)
-                
-                agent = SpatialAgent(idx, box, dx, dy,
-                                     team_conf["conscripted"])
+                if state is not None:
+                    agent = SpatialAgentView(idx, box, dx[i], dy[i],
+                                             team_conf.conscripted, state,
+                                             x=x[i], y=y[i])
+                else:
+                    agent = SpatialAgent(idx, box, dx[i], dy[i],
+                                         team_conf.conscripted,
+                                         x=x[i], y=y[i])
                 agents.append(agent)
                 
-                team_agent_ids.append(idx); idx += 1
-        
-            if team_conf["conscripted"]:
-                duty = {
-                    "on"      : eval(str(   config[    "daysOnDuty"])),
-                    "off"     : eval(str(   config[   "daysOffDuty"])),
-                    "offset"  : eval(str(team_conf["rotationOffset"]))}
-            else:   
-                duty = None
+                idx += 1
             
-            team = Team(f"{team_name}{suffix}", team_agent_ids, duty, box)
+            team = Team(box_name, team_agent_ids, team_conf.duty, box)
             teams.append(team)
         
     # add the soldier's common "Sotilaskoti" inside-the-base shop
@@ -374,127 +863,52 @@ def generate_spatial_entities(config):
         boxes["sotilaskoti"] = Box("sotilaskoti",
                                    **config["sotilaskoti"]["box"])
     
-    return teams, boxes, agents
+    return teams, boxes, agents, state
 
 
 def generate_infection_entities(config):
     
+    params = compile_config(config)
+    
     agents = []
     
     idx = 0
     
-    for team_conf in config["teams"].values():
+    for team_conf in params.teams:
         
-        reps = team_conf.get('repeat',   # if repeats do not exist:
-                             {'times': 1, 'spatialSeparation' : 0})
-        times = eval(str(reps['times']))
+        # all repeats of the team are drawn at once
+        n = team_conf.n_agents * team_conf.times
         
-        for _ in range(times):
+        # countermeasures of conscripts or civilians
+        group = params.groups[team_conf.conscripted]
         
-            for _ in range(team_conf["nAgents"]):
-                
-                """
-                Make an infection
-                
-                """
-                inc_dur = np.random.uniform(
-                    eval(str(config['infection']['incubating']['daysMin'])),
-                    eval(str(config['infection']['incubating']['daysMax']))
-                    )
-                
-                psy_dur = np.random.uniform(
-                    eval(str(config['infection']['preSymptomatic']['daysMin'])),
-                    eval(str(config['infection']['preSymptomatic']['daysMax']))
-                    )
-                
-                inf_dur = np.random.uniform(
-                    eval(str(config['infection']['acute']['daysMin'])),
-                    eval(str(config['infection']['acute']['daysMax']))
-                    )
-                
-                asymt_p = config['infection']['asymptomatic']['chance']
-                asymt_p = eval(str(asymt_p))
-                
-                if team_conf['conscripted']:
-                    mask_p = eval(str(config['mask']['coverage']['military']))
-                    
-                    quar = config['militaryQuarantine']
-                    if quar['use']:
-                        quar_x_p = eval(str(quar['chanceToEnterIfExposed' ]))
-                        quar_s_p = eval(str(quar['chenceToEnterIfSymptoms']))
-                        quar_eff = eval(str(quar['effectiveness']))
-                    else:
-                        quar_x_p = quar_s_p = quar_eff = 0.0
-                
-                else:
-                    mask_p = eval(str(config['mask']['coverage']['civilian']))
-                    
-                    quar = config['civilianSelfQuarantine']
-                    if quar['use']:
-                        quar_x_p = eval(str(quar['chanceToEnterIfExposed' ]))
-                        quar_s_p = eval(str(quar['chenceToEnterIfSymptoms']))
-                        quar_eff = eval(str(quar['effectiveness']))
-                    else:
-                        quar_x_p = quar_s_p = quar_eff = 0.0
-                
-                incub_trx = config['infection'][    'incubating']['contagious']
-                psymt_trx = config['infection']['preSymptomatic']['contagious']
-                sympt_trx = config['infection'][         'acute']['contagious']
-                asymt_trx = config['infection'][  'asymptomatic']['contagious']
-                
-                mask_eff_tx = config['mask']['effectiveness'][   'wearer']
-                mask_eff_rx = config['mask']['effectiveness']['recipient']
-                
-                incub_trx = eval(str(incub_trx))
-                psymt_trx = eval(str(psymt_trx))
-                sympt_trx = eval(str(sympt_trx))
-                asymt_trx = eval(str(asymt_trx))
-                
-                mask_eff_tx = eval(str(mask_eff_tx))
-                mask_eff_rx = eval(str(mask_eff_rx))
-                
-                infection = Infection(
-                    inc_dur, psy_dur, inf_dur, asymt_p,
-                    mask_p, quar_s_p, quar_x_p,
-                    incub_trx, psymt_trx, sympt_trx, asymt_trx,
-                    mask_eff_tx, mask_eff_rx, quar_eff)
-                
-                if team_conf['conscripted']:
-                    meets_dropout = config['meetingsAvoided']['military']
-                    meets_dropout = eval(str(meets_dropout))
-                else:
-                    meets_dropout = config['meetingsAvoided']['civilian']
-                    meets_dropout = eval(str(meets_dropout))
-                
-                """
-                Make an agent with above infection
-                
-                """
-                agent = InfectionAgent(idx, team_conf["conscripted"],
-                                       infection, meets_dropout)
-                agents.append(agent)
+        # random stage durations (uniform distribution), days
+        inc_durs = np.random.uniform(*params.inc_days, n).tolist()
+        psy_durs = np.random.uniform(*params.psy_days, n).tolist()
+        inf_durs = np.random.uniform(*params.inf_days, n).tolist()
+        
+        for inc_dur, psy_dur, inf_dur in zip(inc_durs, psy_durs, inf_durs):
             
-                idx += 1
+            """
+            Make an infection
+            
+            """
+            infection = Infection(
+                inc_dur, psy_dur, inf_dur, params.asymt_p,
+                group.mask_p, group.quar_s_p, group.quar_x_p,
+                params.incub_trx, params.psymt_trx,
+                params.sympt_trx, params.asymt_trx,
+                params.mask_eff_tx, params.mask_eff_rx, group.quar_eff,
+                params.merge_within, params.contact_secs)
+            
+            """
+            Make an agent with above infection
+            
+            """
+            agent = InfectionAgent(idx, team_conf.conscripted,
+                                   infection, group.meets_dropout)
+            agents.append(agent)
+            
+            idx += 1
     
     return agents
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
@@ -2,60 +2,111 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+from checkpoints import checkpoint_path, find_checkpoint
+from checkpoints import load_checkpoint, save_checkpoint
+from contextlib import nullcontext
+from compression import available_codecs, default_codec
+from compression import CompressedWriter, EXTENSIONS
 from datetime import datetime # for timestamp in generated filenames
 import numpy as np
+from meet_table import IntervalWriter, MeetTableWriter
+from partitions import PartitionedSimulation
+from profiling import NullProfiler, Profiler
 import os
 import pickle
 import shutil
-import tarfile
 from tqdm import tqdm 
 import yaml
 from entities import generate_spatial_entities
 from updates import detect_meetings
+from updates import detect_meetings_grid
+from updates import detect_meetings_sorted
 from updates import increment_agent_positions
+from updates import increment_state_positions
+from updates import initial_order
 from updates import initial_sort
+from updates import link_agents
+from updates import new_meetings
+from updates import pairs_to_meetings
 from updates import queue_sotilaskoti
 from updates import rotate_teams
 from updates import x_sort
+from updates import x_sort_order
 
-parser = argparse.ArgumentParser()
-parser.add_argument('--no-visual', action='store_true',
-                    help='Switch off the simulation rendering window',)
-parser.add_argument('-n', '--name', default='',
-                    help='Name tag for the generated config, meetings table \
-                          and result files')
-parser.add_argument('--config', default='',
-                    help=('Path to a configuration file to use instead of a',
-                          'config.yaml in the repository root folder.'))
 
-args = parser.parse_args()
-visualize = not args.no_visual # by default: visualize
+def parse_args(argv=None):
+    
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--no-visual', action='store_true',
+                        help='Switch off the simulation rendering window',)
+    parser.add_argument('--render-every', type=int, default=1,
+                        help='Draw the window every given number of \
+                              simulation steps only')
+    parser.add_argument('--max-fps', type=float, default=60,
+                        help='Upper limit of drawn frames per second. Steps \
+                              simulated in between are not drawn instead of \
+                              waiting for the display (0: no limit)')
+    parser.add_argument('-n', '--name', default='',
+                        help='Name tag for the generated config, meetings \
+                              table and result files')
+    parser.add_argument('--config', default='',
+                        help=('Path to a configuration file to use instead of',
+                              'a config.yaml in the repository root folder.'))
+    parser.add_argument('--engine', default='objects',
+                        choices=['objects','arrays'],
+                        help='Keep agent positions in per-agent objects or in \
+                              numpy arrays (vectorized movement update)')
+    parser.add_argument('--spatial-index', default='sweep',
+                        choices=['sweep','grid'],
+                        help='Find close agents by a sweep along the x-sorted \
+                              list or by binning agents into a uniform grid')
+    parser.add_argument('--codec', default=default_codec(),
+                        choices=available_codecs(),
+                        help='Compression of the generated meetings table \
+                              (zstd is available if zstandard is installed)')
+    parser.add_argument('--threads', type=int, default=0,
+                        help='Number of compression threads \
+                              (default: all cores)')
+    parser.add_argument('--partitions', type=int, default=0,
+                        help='Number of worker processes simulating separate \
+                              groups of boxes (needs --engine arrays and \
+                              --no-visual, neighbours are found with the \
+                              grid). 0 simulates all agents in this process')
+    parser.add_argument('--intervals', action='store_true',
+                        help='Write one record per continuous contact with \
+                              its start and end instead of the contact \
+                              start only (for duration-weighted infection)')
+    parser.add_argument('--checkpoint-every', type=float, default=24,
+                        help='Save the simulation state every given number \
+                              of simulated hours, so that an interrupted \
+                              run can be continued (0: no checkpoints)')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue the interrupted run with the same \
+                              name (and config) from its last checkpoint')
+    parser.add_argument('--profile', action='store_true',
+                        help='Time the phases of the simulation step and \
+                              count meetings, sort moves etc. (a report is \
+                              saved to output/profiles)')
+    
+    args = parser.parse_args(argv)
+    
+    if args.partitions and (args.engine != "arrays" or not args.no_visual):
+        parser.error("--partitions needs --engine arrays and --no-visual")
+    
+    if args.render_every < 1:
+        parser.error("--render-every needs a positive number of steps")
+    
+    return args
 
-"""
-Conditional OpenGL import (only on the module level)
 
-"""
-if visualize:
-    import glfw
-    from OpenGL.GL import ctypes
-    from OpenGL.GL import glBindBuffer, glBufferData, glClear, glClearColor
-    from OpenGL.GL import glDrawArrays, glGenBuffers, glGetAttribLocation
-    from OpenGL.GL import glGetUniformLocation, glEnableVertexAttribArray
-    from OpenGL.GL import glVertexAttribPointer, glUniform2f, glUniform4f
-    from OpenGL.GL import glUseProgram
-    from OpenGL.GL import GL_ARRAY_BUFFER, GL_COLOR_BUFFER_BIT, GL_LINE_LOOP
-    from OpenGL.GL import GL_STATIC_DRAW, GL_TRIANGLES, GL_FLOAT, GL_FALSE
-    from plotting import generate_agents_verticies
-    from plotting import generate_map
-    from plotting import compile_shader
-    import time # for an FPS limit
+def main(args):
     """
-    Sorry for the following OpenGL code. It appears to rely on global variables
-    within the __main__ function and therefore is hard to encapsulate. 
+    Out:
+        paths to the stored config and to the generated meetings table
     """
-
-
-def main(visualize):
+    visualize = not args.no_visual # by default: visualize
+    
+    profiler = Profiler() if args.profile else NullProfiler()
     
     if args.config:
         config_path = args.config
@@ -65,16 +116,48 @@ def main(visualize):
     with open(config_path) as file:
         config = yaml.load(file, Loader=yaml.FullLoader)
     
-    teams, boxes, agents = generate_spatial_entities(config)
+    # an interrupted run continues from its last checkpoint
+    checkpoint = None
     
-    agents_x_sorted = initial_sort(agents)
+    if args.resume:
+        
+        path = find_checkpoint(args.name, timestamped=not args.config)
+        
+        if path is None:
+            print("No checkpoint to resume from found, starting a new run")
+        else:
+            checkpoint = load_checkpoint(path)
+            
+            # the options the simulation state depends on
+            for key, value in checkpoint["args"].items():
+                setattr(args, key, value)
+    
+    if checkpoint is not None:
+        teams, boxes, agents, state = checkpoint["entities"]
+    else:
+        with profiler.phase("generate_entities"):
+            teams, boxes, agents, state = generate_spatial_entities(
+                config, args.engine)
+    
+    if args.spatial_index == "sweep":
+        if state is not None:
+            if checkpoint is None:
+                initial_order(state) # numpy permutation kept in state.order
+        elif checkpoint is not None:
+            agents_x_sorted = initial_sort(agents, checkpoint["x_order"])
+        else:
+            agents_x_sorted = initial_sort(agents) # linked list
     
     if config["sotilaskoti"]["allow"]:
         # create queue to the sotilaskoti
-        q = []
+        q = checkpoint["q"] if checkpoint is not None else []
     
     # table of meetings between agents, from the previous simulation step
-    meets_prev = dict() 
+    if checkpoint is not None:
+        meets_prev = checkpoint["meets_prev"]
+    else:
+        meets_prev = (np.zeros(0, dtype=np.int64),
+                      np.zeros(0, dtype=object))
     
     if visualize:
         
@@ -84,6 +167,14 @@ def main(visualize):
         # verticies for traingles that represent agents
         agents_verts = generate_agents_verticies(config)
         
+        # positions and colors of all agent markers (instances of the marker
+        # triangles), civilians first, then conscripts
+        order, n_civilians, instances = agents_instances(
+            [agent.conscripted for agent in agents])
+        
+        # fences are drawn as one black instance at the origin
+        fences_instance = np.zeros(1, instances.dtype)
+        fences_instance["color"] = (0.0, 0.0, 0.0, 1.0)
         
         if not glfw.init():
             return
@@ -98,39 +189,52 @@ def main(visualize):
         
         glfw.make_context_current(window)
         
-        # compile shader for on-the-fly configurable trianges
+        # frames do not wait for the display refresh, the frame rate is
+        # limited by skipping the drawing instead (--max-fps option)
+        glfw.swap_interval(0)
+        
+        # compile shader for instanced trianges
         shader = compile_shader()
         
-        # create Buffer object in gpu
-        VBO = glGenBuffers(2)
-    
-        # bind buffers
-        glBindBuffer(GL_ARRAY_BUFFER, VBO[0])
-        glBufferData(GL_ARRAY_BUFFER, 
-                     fences_verts.nbytes, 
-                     fences_verts, 
-                     GL_STATIC_DRAW)
+        # create Buffer objects in gpu: fences, marker templates, the fences
+        # instance and the agent instances (rewritten every drawn frame)
+        VBO = glGenBuffers(4)
         
-        glBindBuffer(GL_ARRAY_BUFFER, VBO[1])
-        glBufferData(GL_ARRAY_BUFFER,
-                     agents_verts.nbytes,
-                     agents_verts,
-                     GL_STATIC_DRAW)
+        for vbo, data, usage in ((VBO[0], fences_verts, GL_STATIC_DRAW),
+                                 (VBO[1], agents_verts, GL_STATIC_DRAW),
+                                 (VBO[2], fences_instance, GL_STATIC_DRAW),
+                                 (VBO[3], instances, GL_DYNAMIC_DRAW)):
+            glBindBuffer(GL_ARRAY_BUFFER, vbo)
+            glBufferData(GL_ARRAY_BUFFER, data.nbytes, data, usage)
         
         fences_stride = fences_verts.strides[0]
         agents_stride = agents_verts.strides[0]
-    
-        # get the position from vertex shader
-        # stride offset
-        offset = ctypes.c_void_p(0)
-        init_pos = glGetAttribLocation(shader, 'init_pos')
-        glVertexAttribPointer(init_pos, 2, GL_FLOAT,
-                              GL_FALSE, agents_stride, offset)
-        glEnableVertexAttribArray(init_pos)
+        instance_stride = instances.strides[0]
+        
+        # offsets of the fields within an instance record
+        pos_offset   = instances.dtype.fields[ "pos" ][1]
+        color_offset = instances.dtype.fields["color"][1]
+        
+        # get the attributes from vertex shader
+        init_pos   = glGetAttribLocation(shader, 'init_pos')
+        inst_pos   = glGetAttribLocation(shader, 'inst_pos')
+        inst_color = glGetAttribLocation(shader, 'inst_color')
+        
+        for attribute in (init_pos, inst_pos, inst_color):
+            glEnableVertexAttribArray(attribute)
+        
+        # instance attributes advance once per instance, not per vertex
+        glVertexAttribDivisor(inst_pos, 1)
+        glVertexAttribDivisor(inst_color, 1)
+        
+        outline = glGetUniformLocation(shader, 'outline')
     
         glUseProgram(shader)
     
         glClearColor(1.0, 1.0, 1.0, 1.0)
+        
+        frame_time = 0.0 # wall time of the last drawn frame
+        frame_period = 1/args.max_fps if args.max_fps > 0 else 0.0
     
     """
     Prepare directories to store:
@@ -152,7 +256,9 @@ def main(visualize):
         if not os.path.exists(path):
              os.makedirs(path)
     
-    if args.config:
+    if checkpoint is not None:
+        tag = checkpoint["tag"]
+    elif args.config:
         # in this usage scenario all identifiers are set manually
         # (unique tags are generated in meta-loop that launches these scripts)
         tag = args.name
@@ -166,21 +272,46 @@ def main(visualize):
     dump_config_path = os.path.join(
         paths["configs"], "config_"+ tag +".yaml")
     
-    shutil.copy(config_path, dump_config_path)
-    
     # store agents for the further move speed / infection spread correlating
     agents_souls_path = os.path.join(
         paths["agents"], "spatial_agents_"+ tag +".bin")
     
-    with open(agents_souls_path, 'wb') as file:
-        pickle.dump(agents, file)
+    # (a resumed run has stored them already)
+    if checkpoint is None:
+        
+        shutil.copy(config_path, dump_config_path)
+        
+        with profiler.phase("dump_agents"), open(agents_souls_path,
+                                                  'wb') as file:
+            pickle.dump(agents, file)
     
     # create the file with agent meetings
-    # originally a .bin file, is later compressed to the .bin.tar.bz2 format
+    # a .bin table, compressed on the fly (e.g. to .bin.zst) while written
     meets_table_path = os.path.join(
-        paths["meet_tables"], "meet_table_"+ tag +".bin")
+        paths["meet_tables"], "meet_table_"+ tag +".bin"
+        + EXTENSIONS[args.codec])
     
-    with open(meets_table_path, 'wb') as file:
+    # groups of boxes simulated by worker processes
+    if args.partitions:
+        simulation = PartitionedSimulation(state, teams, boxes, config,
+                                           args.partitions)
+    else:
+        simulation = nullcontext()
+    
+    # the table of a resumed run is continued from the checkpoint offset
+    offset = checkpoint["offset"] if checkpoint is not None else None
+    
+    with simulation, CompressedWriter(meets_table_path, args.codec,
+                                      args.threads, offset=offset) as file:
+        
+        # meetings are written as typed records, places as ids of box names
+        if checkpoint is not None:
+            writer = checkpoint["writer"]
+            writer.file = file
+        elif args.intervals:
+            writer = IntervalWriter(file, boxes.keys(), len(agents))
+        else:
+            writer = MeetTableWriter(file, boxes.keys())
         
         # run until the end of the set simulation period
         
@@ -189,7 +320,21 @@ def main(visualize):
         
         eval_times = np.arange(0, T, dt)
         
-        for eval_time in tqdm(eval_times):
+        # checkpoints are saved every checkpoint_steps steps
+        checkpoint_steps = int(args.checkpoint_every * 3600 // dt)
+        
+        checkpoint_file = checkpoint_path(tag)
+        
+        if checkpoint is not None:
+            start = checkpoint["step"]
+            np.random.set_state(checkpoint["rng"])
+        else:
+            start = 0
+        
+        for step in tqdm(range(start, len(eval_times)),
+                         initial=start, total=len(eval_times)):
+            
+            eval_time = eval_times[step]
             
             """
             Transition agents between service and leave
@@ -199,63 +344,138 @@ def main(visualize):
             # some agents prefer to stay on the base during holidays
             stay_chance = config.get('dontGoOffDuty', 0.0)
             
-            rotate_teams(entities, stay_chance, eval_time, dt)
+            with profiler.phase("rotate_teams"):
+                rotate_teams(entities, stay_chance, eval_time, dt)
             
             """
             Transition agents to "Sotilaskoti" cafeteria and back
             """
             if config["sotilaskoti"]["allow"]:
                 
-                queue_sotilaskoti(entities, q, eval_time, dt, config)
+                with profiler.phase("sotilaskoti"):
+                    queue_sotilaskoti(entities, q, eval_time, dt, config)
             
             """
             Update agent positions (along one time step)
             """
-            increment_agent_positions(agents)
-            
-            """
-            Refresh the sorting of agents after the positions update
-            """
-            x_sort(agents_x_sorted)
+            if args.partitions:
+                
+                # the workers move agents and find close ones
+                with profiler.phase("partitions"):
+                    ia, ib, later = simulation.step(eval_time)
+                
+            elif state is not None:
+                with profiler.phase("move"):
+                    increment_state_positions(state)
+            else:
+                with profiler.phase("move"):
+                    increment_agent_positions(agents)
             
             """
             Register new meetings between agents and export them to file
             """
-            meets_curr = detect_meetings(agents_x_sorted, eval_time,
-                                         config, visualize)
+            if args.partitions:
+                
+                with profiler.phase("detect"):
+                    meets_curr = pairs_to_meetings(agents, ia, ib, later,
+                                                   state)
+            
+            elif args.spatial_index == "sweep" and state is not None:
+                
+                # refresh the sorting of agents after the positions update
+                with profiler.phase("sort"):
+                    x_sort_order(state, profiler=profiler)
+                
+                with profiler.phase("detect"):
+                    meets_curr = detect_meetings_sorted(agents, eval_time,
+                                                        config, state,
+                                                        profiler)
+            elif args.spatial_index == "sweep":
+                
+                with profiler.phase("sort"):
+                    x_sort(agents_x_sorted, profiler)
+                
+                with profiler.phase("detect"):
+                    meets_curr = detect_meetings(agents_x_sorted, eval_time,
+                                                 config, profiler)
+            else:
+                with profiler.phase("detect"):
+                    meets_curr = detect_meetings_grid(agents, eval_time,
+                                                      config, state,
+                                                      profiler)
             
-            # each key is a meeting link between two agents 
-            # in the form {agent1_idx, agent2_idx}
-            links_curr = set( meets_curr.keys() )
-            links_prev = set( meets_prev.keys() )
+            profiler.count("close_pairs", len(meets_curr[0]))
             
-            meets_new = dict()
+            n_records = writer.n_records
             
-            for link in links_curr:
+            # each link is a number made of the idxs of two agents
+            # (see link_keys), links of both steps are sorted arrays
+            if args.intervals:
+                
+                # contacts are written once they are over
+                with profiler.phase("link_diff"):
+                    writer.update(eval_time, *meets_curr)
+            else:
+                with profiler.phase("link_diff"):
+                    links_new, places_new = new_meetings(meets_curr,
+                                                         meets_prev)
                 
-                if link not in links_prev:
+                if len(links_new):
                     
-                    meets_new[link] = meets_curr[link]
+                    agent_a, agent_b = link_agents(links_new, len(agents))
+                    
+                    with profiler.phase("write"):
+                        writer.write(eval_time, agent_a, agent_b, places_new)
+            
+            profiler.count("records", writer.n_records - n_records)
+            profiler.count("bytes_written", (writer.n_records - n_records)
+                                            * writer.dtype.itemsize)
+            
+            meets_prev = meets_curr
             
-            if meets_new:
+            """
+            Save the simulation state to continue from (--resume option)
+            """
+            if (checkpoint_steps and (step+1) % checkpoint_steps == 0
+                and step+1 < len(eval_times)):
                 
-                timeline = {"timestamp" : eval_time,
-                             "meetings" : meets_new}
+                if args.spatial_index == "sweep" and state is None:
+                    x_order = [agent.idx for agent in agents_x_sorted]
+                else:
+                    x_order = None
                 
-                pickle.dump(timeline, file)
+                queue = q if config["sotilaskoti"]["allow"] else None
+                
+                with profiler.phase("checkpoint"):
+                    save_checkpoint(checkpoint_file, {
+                        "tag"       : tag,
+                        "args"      : {key: getattr(args, key) for key in (
+                                       "engine", "spatial_index", "codec",
+                                       "intervals")},
+                        "step"      : step+1,
+                        "entities"  : (teams, boxes, agents, state),
+                        "x_order"   : x_order,
+                        "q"         : queue,
+                        "meets_prev": meets_prev,
+                        "rng"       : np.random.get_state(),
+                        "writer"    : writer,
+                        "offset"    : file.sync()})
             
-            meets_prev = meets_curr
+            profiler.step()
             
             """
             Plot canvas if not specified otherwise (--no-visual option)
             """
-            if visualize:
+            if visualize and (step % args.render_every == 0
+                              and time.time() - frame_time >= frame_period):
+                
+                frame_time = time.time()
+                
+                glfw.poll_events()
                 
                 if glfw.window_should_close(window):
                     break
                 
-                time_zero = time.time()
-                
                 glClear(GL_COLOR_BUFFER_BIT)
                 
                 """
@@ -271,91 +491,132 @@ def main(visualize):
                 Draw borders (i.e. boxes, i.e. fences) - 1 px black outlines
                 """
                 glBindBuffer(GL_ARRAY_BUFFER, VBO[0])
-                glVertexAttribPointer(init_pos, 2, GL_FLOAT,
-                                      GL_FALSE, fences_stride, offset)
-                glEnableVertexAttribArray(init_pos)
+                glVertexAttribPointer(init_pos, 2, GL_FLOAT, GL_FALSE,
+                                      fences_stride, ctypes.c_void_p(0))
                 
-                transformLoc = glGetUniformLocation(shader, "dyn_pos")
-                glUniform2f(transformLoc, 0.0, 0.0)
+                glBindBuffer(GL_ARRAY_BUFFER, VBO[2])
+                glVertexAttribPointer(inst_pos, 2, GL_FLOAT, GL_FALSE,
+                                      instance_stride,
+                                      ctypes.c_void_p(pos_offset))
+                glVertexAttribPointer(inst_color, 4, GL_FLOAT, GL_FALSE,
+                                      instance_stride,
+                                      ctypes.c_void_p(color_offset))
                 
-                transformLoc = glGetUniformLocation(shader, "dyn_color")
-                glUniform4f(transformLoc, 0.0, 0.0, 0.0, 0.0)
-        
-                glDrawArrays(GL_TRIANGLES, 0, len(fences_verts))
+                glUniform1f(outline, 0.0)
+                glDrawArraysInstanced(GL_TRIANGLES, 0, len(fences_verts), 1)
                 
                 """
                 Draw agents (i.e. conscripts and civilians)
                 """
+                # agents within a Euclidean circle of somebody are red
+                near = np.zeros(len(agents), dtype=bool)
+                
+                for idxs in link_agents(meets_curr[0], len(agents)):
+                    near[idxs] = True
+                
+                if state is not None:
+                    x, y = state.x, state.y
+                else:
+                    x = np.fromiter((agent.x for agent in agents), float,
+                                    len(agents))
+                    y = np.fromiter((agent.y for agent in agents), float,
+                                    len(agents))
+                
+                update_instances(instances, order, x, y, near, canvas)
+                
+                # all agents are uploaded at once
+                glBindBuffer(GL_ARRAY_BUFFER, VBO[3])
+                glBufferSubData(GL_ARRAY_BUFFER, 0, instances.nbytes,
+                                instances)
+                
                 glBindBuffer(GL_ARRAY_BUFFER, VBO[1])
-                glVertexAttribPointer(init_pos, 2, GL_FLOAT,
-                                      GL_FALSE, agents_stride, offset)
-                glEnableVertexAttribArray(init_pos)
+                glVertexAttribPointer(init_pos, 2, GL_FLOAT, GL_FALSE,
+                                      agents_stride, ctypes.c_void_p(0))
                 
-                for i, agent in enumerate(agents):
-                    
-                    poly_prop = np.zeros(1, [( "pos" , np.float32, 2),
-                                             ("color", np.float32, 4)])
+                glBindBuffer(GL_ARRAY_BUFFER, VBO[3])
+                
+                # civilian triangles are the template verticies 0..2,
+                # conscript upside-down triangles are the verticies 3..5
+                for first, count, vertex in (
+                        (0, n_civilians, 0),
+                        (n_civilians, len(agents) - n_civilians, 3)):
                     
-                    # absolute to relative coordinates, meters -> fractions
-                    x = (agent.x/canvas[ "width"]*2 - 1)*0.99
-                    y = (agent.y/canvas["height"]*2 - 1)*0.99
+                    if not count:
+                        continue
                     
-                    poly_prop["pos"] = (x, y)
+                    start = first * instance_stride
                     
-                    transformLoc = glGetUniformLocation(shader, "dyn_pos")
-                    glUniform2f(transformLoc, *poly_prop["pos"].T)
+                    glVertexAttribPointer(inst_pos, 2, GL_FLOAT, GL_FALSE,
+                                          instance_stride,
+                                          ctypes.c_void_p(start + pos_offset))
+                    glVertexAttribPointer(inst_color, 4, GL_FLOAT, GL_FALSE,
+                                          instance_stride,
+                                          ctypes.c_void_p(start
+                                                          + color_offset))
                     
                     """
                     Agent triangle marker filling
                     """
-                    poly_prop["color"] = agent.color
-                    
-                    transformLoc = glGetUniformLocation(shader, "dyn_color")
-                    glUniform4f(transformLoc, *poly_prop["color"].T)
-    
-                    if agent.conscripted:
-                        glDrawArrays(GL_TRIANGLES, 3, 6)
-                    else:
-                        glDrawArrays(GL_TRIANGLES, 0, 3)
+                    glUniform1f(outline, 0.0)
+                    glDrawArraysInstanced(GL_TRIANGLES, vertex, 3, count)
                     
                     """
                     Marker outline
                     """
-                    transformLoc = glGetUniformLocation(shader, "dyn_color")
-                    glUniform4f(transformLoc, 0.0, 0.0, 0.0, 1.0) # black
-                    
-                    if agent.conscripted:
-                        glDrawArrays(GL_LINE_LOOP, 3, 6)
-                    else:
-                        glDrawArrays(GL_LINE_LOOP, 0, 3)
+                    glUniform1f(outline, 1.0)
+                    glDrawArraysInstanced(GL_LINE_LOOP, vertex, 3, count)
                 
                 glfw.swap_buffers(window)
-                
-                # FPS limited to 60
-                while(time.time() - time_zero < 1/60):
-                    time.sleep(0.001)
-                glfw.poll_events()
+        
+        # contacts still open at the simulation end are finished with it
+        # (also if the loop has not run a single step, e.g. a resumed run
+        # which had already reached its last step)
+        if args.intervals:
+            writer.close(int(np.ceil(T)))
+    
+    # the run is complete, there is nothing to resume
+    if os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+    
+    profiler.save(os.path.join("output", "profiles",
+                               "profile_generate_"+ tag +".json"))
     
     if visualize:
         glfw.terminate()
     
+    return dump_config_path, meets_table_path
+
+
+if __name__ == "__main__":
+    
+    args = parse_args()
+    
     """
-    Compress output file to save space 
-    """
-    compressed_path = os.path.join(
-        paths["meet_tables"], "meet_table_"+ tag +".bin.tar.bz2")
+    Conditional OpenGL import (only on the module level)
     
-    with tarfile.open(compressed_path, "w:bz2") as tar:
-        tar.add(meets_table_path)
+    """
+    if not args.no_visual:
+        import glfw
+        from OpenGL.GL import ctypes
+        from OpenGL.GL import glBindBuffer, glBufferData, glBufferSubData
+        from OpenGL.GL import glClear, glClearColor, glDrawArraysInstanced
+        from OpenGL.GL import glEnableVertexAttribArray, glGenBuffers
+        from OpenGL.GL import glGetAttribLocation, glGetUniformLocation
+        from OpenGL.GL import glUniform1f, glUseProgram
+        from OpenGL.GL import glVertexAttribDivisor, glVertexAttribPointer
+        from OpenGL.GL import GL_ARRAY_BUFFER, GL_COLOR_BUFFER_BIT
+        from OpenGL.GL import GL_DYNAMIC_DRAW, GL_LINE_LOOP
+        from OpenGL.GL import GL_STATIC_DRAW, GL_TRIANGLES, GL_FLOAT, GL_FALSE
+        from rendering import agents_instances
+        from rendering import generate_agents_verticies
+        from rendering import generate_map
+        from rendering import compile_shader
+        from rendering import update_instances
+        import time # for the frame rate limit
+        """
+        Sorry for the following OpenGL code. It appears to rely on global
+        variables within the main function and therefore is hard to
+        encapsulate. 
+        """
     
-    # in case compressing went successful, remove the source file
-    if os.path.exists(compressed_path):
-        os.remove(meets_table_path)
-        
-
-if __name__ == "__main__":
-    main(visualize)
-
-
-
-
+    main(args)
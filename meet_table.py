@@ -0,0 +1,681 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file contains the meeting table file format: writing it during the
+meetings generation and reading it back during the infection calculation.
+
+A table file starts with the magic bytes, followed by the length of a JSON
+header and the header itself. The header stores the format version, the
+record layout and the dictionary of place (box) names. The rest of the file
+is a plain array of fixed-width records (see MEET_DTYPE), one record per new
+meeting, ordered by timestamp. Hence an uncompressed table can be loaded
+with numpy.memmap (or np.fromfile) at the data offset, and its fields are
+available as parallel arrays without any copying, e.g. table["agent_a"].
+
+Interval tables (see IntervalWriter) hold one record per continuous contact
+instead: the "timestamp" field is the contact start and the additional
+"t_end" field is its end (see INTERVAL_DTYPE). Records are ordered by the
+contact start as well, hence both kinds are read the same way.
+
+Table files are usually compressed (see compression.py), readers detect the
+codec on their own.
+
+Tables from older versions are a stream of pickled
+{"timestamp": ts, "meetings": {frozenset: place}} records inside a
+.bin.tar.bz2 archive. They are still readable.
+"""
+import json
+import os
+import pickle
+import queue
+import shutil
+import struct
+import tarfile
+import threading
+import numpy as np
+from compression import detect_codec, open_decompressed
+
+MAGIC = b"PYRONAMT"
+
+VERSION = 1
+
+MEET_DTYPE = np.dtype([("timestamp", "<i4"), # seconds from simulation start
+                       ("agent_a"  , "<i4"), # agent idxs of the meeting link
+                       ("agent_b"  , "<i4"),
+                       ("place"    , "<u2")]) # index in places dictionary
+
+# records of interval tables: the timestamp is the contact start, t_end is
+# the first step the agents are no longer close (i.e. exclusive end)
+INTERVAL_DTYPE = np.dtype(MEET_DTYPE.descr + [("t_end", "<i4")])
+
+# streaming reader settings: records decoded at once, chunks read ahead
+CHUNK_RECORDS = 1 << 16
+PREFETCH_CHUNKS = 8
+
+# seconds between the checks of the read ahead thread whether its consumer
+# has stopped
+READ_AHEAD_POLL = 0.1
+
+
+class MeetTableWriter():
+    
+    def __init__(self, file, places, dtype=MEET_DTYPE):
+        """
+        - file is a file object opened for binary writing
+        - places is a list with names of all boxes where agents can meet
+        - dtype is the record layout (MEET_DTYPE or INTERVAL_DTYPE)
+        """
+        self.file = file
+        self.dtype = dtype
+        self.places = list(places)
+        self.place_ids = {name: i for i, name in enumerate(self.places)}
+        
+        header = {"version" : VERSION,
+                  "dtype"   : [list(field) for field in dtype.descr],
+                  "places"  : self.places}
+        
+        header = json.dumps(header).encode()
+        
+        # pad the header, so that the records start at an 8-byte boundary
+        pad = -(len(MAGIC) + 4 + len(header)) % 8
+        header += b" " * pad
+        
+        self.file.write(MAGIC + struct.pack("<I", len(header)) + header)
+        
+        self.n_records = 0
+    
+    def __getstate__(self):
+        
+        # a pickled writer (see checkpoints.py) keeps all but the file
+        state = self.__dict__.copy()
+        del state["file"]
+        
+        return state
+    
+    def write(self, timestamp, agent_a, agent_b, places):
+        """
+        Args:
+            timestamp: time in seconds elapsed from the simulation start
+            agent_a, agent_b: arrays with agent idxs of the meeting links
+            places: array with the place (box name) of each meeting
+        """
+        records = np.empty(len(places), self.dtype)
+        
+        records["timestamp"] = timestamp
+        records["agent_a"] = agent_a
+        records["agent_b"] = agent_b
+        records["place"] = self.place_idxs(places)
+        
+        self.write_records(records)
+    
+    def place_idxs(self, places):
+        """
+        Out:
+            array with ids of the place names (looked up once per name)
+        """
+        if not len(places):
+            return np.zeros(0, dtype=np.uint16)
+        
+        names, inverse = np.unique(places, return_inverse=True)
+        
+        ids = np.array([self.place_ids[name] for name in names])
+        
+        return ids[inverse]
+    
+    def write_records(self, records):
+        
+        self.file.write(records.tobytes())
+        
+        self.n_records += len(records)
+
+
+class IntervalWriter(MeetTableWriter):
+    
+    def __init__(self, file, places, n_agents):
+        """
+        Meeting table writer which tracks open contacts between steps and
+        writes one record per continuous contact (see INTERVAL_DTYPE) once
+        it is over. Hence the table keeps contact durations, e.g. a long
+        wait in a queue and a brief pass-by are told apart.
+        - n_agents is the number of all agents (see updates.link_keys)
+        """
+        super().__init__(file, places, INTERVAL_DTYPE)
+        
+        self.n_agents = n_agents
+        
+        # open contacts: sorted links, their starts and place ids
+        self.links       = np.zeros(0, dtype=np.int64)
+        self.starts      = np.zeros(0, dtype=np.int64)
+        self.open_places = np.zeros(0, dtype=np.uint16)
+        
+        # finished contacts are held back until no earlier started contact
+        # is open, so that the records are ordered by the contact start; the
+        # backlog is kept sorted by the start, and by the link within one
+        # start
+        self.pending = np.zeros(0, dtype=INTERVAL_DTYPE)
+    
+    def update(self, eval_time, links, places):
+        """
+        Args:
+            eval_time: time in seconds elapsed from the simulation start
+            links: sorted array with links of close agents (see link_keys)
+            places: array with the place (box name) of each link
+        """
+        # contacts that go on keep their start and place
+        pos = np.minimum(np.searchsorted(self.links, links),
+                         max(len(self.links) - 1, 0))
+        
+        if len(self.links):
+            going_on = self.links[pos] == links
+        else:
+            going_on = np.zeros(len(links), dtype=bool)
+        
+        # open contacts missing now are over
+        ended = np.ones(len(self.links), dtype=bool)
+        ended[pos[going_on]] = False
+        
+        self.finish(ended, eval_time)
+        
+        starts = np.full(len(links), eval_time, dtype=np.int64)
+        starts[going_on] = self.starts[pos[going_on]]
+        
+        place_ids = np.empty(len(links), dtype=np.uint16)
+        place_ids[going_on] = self.open_places[pos[going_on]]
+        place_ids[~going_on] = self.place_idxs(places[~going_on])
+        
+        self.links, self.starts, self.open_places = links, starts, place_ids
+        
+        self.flush()
+    
+    def close(self, end_time):
+        """
+        Finish all open contacts at end_time (the simulation end) and write
+        the remaining records.
+        """
+        self.finish(np.ones(len(self.links), dtype=bool), end_time)
+        
+        self.links = self.links[:0]
+        self.starts = self.starts[:0]
+        self.open_places = self.open_places[:0]
+        
+        self.flush()
+    
+    def finish(self, ended, end_time):
+        """
+        Move the open contacts selected by the ended mask to the pending
+        records (merged into the sorted backlog, which is not sorted again).
+        """
+        if not ended.any():
+            return
+        
+        links = self.links[ended]
+        
+        records = np.empty(len(links), INTERVAL_DTYPE)
+        
+        records["timestamp"] = self.starts[ended]
+        records["agent_a"] = links // self.n_agents
+        records["agent_b"] = links % self.n_agents
+        records["place"] = self.open_places[ended]
+        records["t_end"] = end_time
+        
+        # the links are sorted already, a stable sort by the start orders
+        # the new records as the backlog
+        records = records[np.argsort(records["timestamp"], kind='stable')]
+        
+        # records compare field by field, i.e. by the start and then by the
+        # link, hence their sorted positions in the backlog
+        pos = np.searchsorted(self.pending, records)
+        
+        self.pending = np.insert(self.pending, pos, records)
+    
+    def flush(self):
+        """
+        Write the pending records which started before all open contacts.
+        """
+        oldest = self.starts.min() if len(self.starts) else np.inf
+        
+        cut = np.searchsorted(self.pending["timestamp"], oldest, side='left')
+        
+        if cut:
+            self.write_records(self.pending[:cut])
+            
+            self.pending = self.pending[cut:]
+
+
+def read_header(file):
+    """
+    Args:
+        file: file object positioned at the table start
+    Out:
+        header: dict with the table header, or None if the file does not
+                start with the magic bytes (i.e. it is a legacy pickle table)
+        offset: number of bytes consumed from the file
+    """
+    magic = file.read(len(MAGIC))
+    
+    if magic != MAGIC:
+        return None, magic
+    
+    (size,) = struct.unpack("<I", file.read(4))
+    
+    header = json.loads(file.read(size))
+    
+    return header, len(MAGIC) + 4 + size
+
+
+def record_dtype(header):
+    """
+    Out:
+        numpy dtype of the table records (MEET_DTYPE or INTERVAL_DTYPE)
+    """
+    return np.dtype([tuple(field) for field in header["dtype"]])
+
+
+def load_meet_table(path):
+    """
+    Load the records of an uncompressed (.bin) table without copying them.
+    Args:
+        path: path to the table file
+    Out:
+        records: numpy.memmap with MEET_DTYPE (or INTERVAL_DTYPE) records
+        places: list with place names, the "place" field indexes into it
+    """
+    with open(path, 'rb') as file:
+        header, offset = read_header(file)
+    
+    if header is None:
+        raise ValueError(f"{path} is not a columnar meeting table")
+    
+    records = np.memmap(path, dtype=record_dtype(header), mode='r',
+                        offset=offset)
+    
+    return records, header["places"]
+
+
+def split_steps(records):
+    """
+    Group records by timestamp.
+    Out:
+        generator of (timestamp, records) tuples, records of one timestamp
+        are a slice (view) of the input records
+    """
+    ts = records["timestamp"]
+    
+    bounds = np.flatnonzero(np.diff(ts)) + 1
+    
+    starts = np.concatenate(([0], bounds))
+    ends   = np.concatenate((bounds, [len(ts)]))
+    
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        
+        if start == end:
+            continue
+        
+        yield int(ts[start]), records[start:end]
+
+
+def record_durations(records):
+    """
+    Out:
+        array with contact durations in seconds (interval tables), or None
+    """
+    if "t_end" not in records.dtype.names:
+        return None
+    
+    return records["t_end"] - records["timestamp"]
+
+
+def split_timelines(records, places):
+    """
+    Group records by timestamp.
+    Out:
+        list with (timestamp, meetings) tuples, where meetings is a list of
+        (agent_a, agent_b, place, duration) tuples. The duration (seconds)
+        is known for interval tables only, otherwise it is None.
+    """
+    timelines = []
+    
+    for ts, step in split_steps(records):
+        
+        durations = record_durations(step)
+        
+        if durations is None:
+            durations = [None] * len(step)
+        else:
+            durations = durations.tolist()
+        
+        meetings = list(zip(step["agent_a"].tolist(),
+                            step["agent_b"].tolist(),
+                            [places[p] for p in step["place"].tolist()],
+                            durations))
+        
+        timelines.append((ts, meetings))
+    
+    return timelines
+
+
+def iter_records(file, chunk_size, dtype=MEET_DTYPE):
+    """
+    Read records from the file object in chunks (after the header).
+    Out:
+        generator of dtype arrays with at most chunk_size records
+    """
+    itemsize = dtype.itemsize
+    
+    rest = b"" # incomplete record at the end of the previous read
+    
+    while True:
+        
+        data = file.read(chunk_size * itemsize)
+        
+        if not data:
+            break
+        
+        data = rest + data
+        
+        n = len(data) // itemsize
+        
+        rest = data[n*itemsize:]
+        
+        yield np.frombuffer(data, dtype=dtype, count=n)
+
+
+def read_record_chunks(file, chunk_size=CHUNK_RECORDS):
+    """
+    Read records from a table file object of either format chunk by chunk.
+    Each chunk holds all records of its timestamps (a timestamp is never
+    split between two chunks).
+    Out:
+        generator of (records, places) tuples: MEET_DTYPE (INTERVAL_DTYPE
+        for interval tables) arrays and the list
+        with place names which the "place" field indexes into
+    """
+    header, head = read_header(file)
+    
+    if header is not None:
+        
+        places = header["places"]
+        dtype  = record_dtype(header)
+        
+        # records of the last timestamp in a chunk may continue in the next
+        # chunk, therefore they are held back until the timestamp changes
+        pending = np.zeros(0, dtype=dtype)
+        
+        for records in iter_records(file, chunk_size, dtype):
+            
+            records = np.concatenate((pending, records))
+            
+            if not len(records):
+                continue
+            
+            ts = records["timestamp"]
+            
+            cut = np.searchsorted(ts, ts[-1], side='left')
+            
+            pending = records[cut:]
+            
+            yield records[:cut], places
+        
+        yield pending, places
+        
+        return
+    
+    # legacy pickle stream, the bytes consumed by the magic check are put back
+    file = _Prepended(head, file)
+    
+    # the places dictionary is built on the fly
+    places, place_ids = [], dict()
+    
+    rows = []
+    
+    while True:
+        try:
+            timeline = pickle.load(file)
+        except EOFError:
+            break
+        
+        ts = timeline["timestamp"]
+        
+        for link, place in timeline["meetings"].items():
+            
+            if place not in place_ids:
+                place_ids[place] = len(places)
+                places.append(place)
+            
+            rows.append((ts, *tuple(link), place_ids[place]))
+        
+        if len(rows) >= chunk_size:
+            yield np.array(rows, dtype=MEET_DTYPE), places
+            rows = []
+    
+    yield np.array(rows, dtype=MEET_DTYPE), places
+
+
+def iter_record_chunks(path, chunk_size=CHUNK_RECORDS,
+                       prefetch=PREFETCH_CHUNKS):
+    """
+    Stream records from a table file, compressed with any of the codecs
+    (see compression.py) or inside a legacy .bin.tar.bz2 archive, without
+    extracting or loading the whole table. Chunks are decompressed and
+    decoded in a background thread, up to prefetch chunks ahead, so that the
+    reading overlaps with the infection calculation (decompression releases
+    the GIL). Memory use is bounded by the chunk size instead of the table.
+    Args:
+        path: path to a (compressed) table file
+        chunk_size: number of records decoded at once
+        prefetch: number of chunks read ahead, 0 reads in the calling thread
+    Out:
+        generator of (records, places) tuples, see read_record_chunks
+    """
+    if detect_codec(path) == "none":
+        
+        with open(path, 'rb') as file:
+            header, _ = read_header(file)
+        
+        # uncompressed tables are memory-mapped, nothing to read ahead
+        if header is not None:
+            yield from _mapped_record_chunks(path, chunk_size)
+            return
+    
+    chunks = _read_record_chunks(path, chunk_size)
+    
+    if prefetch:
+        chunks = read_ahead(chunks, prefetch)
+    
+    yield from chunks
+
+
+def _mapped_record_chunks(path, chunk_size):
+    
+    records, places = load_meet_table(path)
+    
+    ts = records["timestamp"]
+    
+    start = 0
+    
+    while start < len(records):
+        
+        end = start + chunk_size
+        
+        # move the chunk end to a timestamp boundary
+        if end < len(records):
+            end = int(np.searchsorted(ts, ts[end], side='left'))
+            
+            if end <= start:
+                end = int(np.searchsorted(ts, ts[start], side='right'))
+        
+        yield records[start:end], places
+        
+        start = end
+
+
+def _read_record_chunks(path, chunk_size):
+    
+    with open_decompressed(path) as file:
+        
+        # legacy archives are tar files with the table inside
+        head = file.read(512)
+        
+        stream = _Prepended(head, file)
+        
+        if len(head) == 512 and head[257:262] == b"ustar":
+            
+            # "r|" is a sequential stream: nothing is extracted to disk
+            with tarfile.open(fileobj=stream, mode="r|") as tar:
+                
+                for member in tar:
+                    yield from read_record_chunks(tar.extractfile(member),
+                                                  chunk_size)
+            return
+        
+        yield from read_record_chunks(stream, chunk_size)
+
+
+def iter_timelines(path, chunk_size=CHUNK_RECORDS, prefetch=PREFETCH_CHUNKS):
+    """
+    Yield (timestamp, meetings) tuples one by one, where meetings is a list of
+    (agent_a, agent_b, place, duration) tuples. See iter_record_chunks for
+    arguments.
+    """
+    for records, places in iter_record_chunks(path, chunk_size, prefetch):
+        yield from split_timelines(records, places)
+
+
+def iter_steps(path, chunk_size=CHUNK_RECORDS, prefetch=PREFETCH_CHUNKS):
+    """
+    Yield (timestamp, records, places) tuples one by one: records of one
+    timestamp as a MEET_DTYPE (or INTERVAL_DTYPE) array and the list of place names. See
+    iter_record_chunks for arguments.
+    """
+    for records, places in iter_record_chunks(path, chunk_size, prefetch):
+        for ts, step in split_steps(records):
+            yield ts, step, places
+
+
+def decode_table(src_path, dst_path):
+    """
+    Decode a table of any codec or format into an uncompressed table, which
+    can be memory-mapped (see load_meet_table) and hence shared by several
+    processes reading it at the same time.
+    Args:
+        src_path: path to a (compressed or legacy) table file
+        dst_path: path to the .bin table to create
+    """
+    records_path = dst_path + ".records"
+    
+    # the places dictionary of legacy tables is complete only at the end,
+    # therefore records are written before the header
+    places, dtype = [], MEET_DTYPE
+    
+    with open(records_path, 'wb') as file:
+        for records, places in iter_record_chunks(src_path):
+            file.write(records.tobytes())
+            dtype = records.dtype
+    
+    part_path = dst_path + ".part"
+    
+    with open(part_path, 'wb') as file:
+        
+        MeetTableWriter(file, places, dtype)
+        
+        with open(records_path, 'rb') as records_file:
+            shutil.copyfileobj(records_file, file, 1 << 24)
+    
+    os.remove(records_path)
+    os.replace(part_path, dst_path)
+
+
+def read_ahead(iterable, maxsize):
+    """
+    Consume the iterable in a daemon thread, keeping at most maxsize items
+    in a queue. Exceptions of the producer are re-raised in the consumer.
+    When the consumer stops early (an exception or the generator closed),
+    the producer stops too and closes the iterable (e.g. its open file).
+    """
+    items = queue.Queue(maxsize)
+    
+    stop = threading.Event()
+    
+    def put(item):
+        # a full queue is retried until the consumer stops
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=READ_AHEAD_POLL)
+                return True
+            except queue.Full:
+                pass
+        
+        return False
+    
+    def produce():
+        try:
+            for item in iterable:
+                if not put((True, item)):
+                    break
+        except BaseException as e:
+            put((False, e))
+        else:
+            put((False, None))
+        finally:
+            # a generator is closed in the thread it runs in
+            if hasattr(iterable, "close"):
+                iterable.close()
+    
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    
+    try:
+        while True:
+            
+            ok, item = items.get()
+            
+            if not ok:
+                if item is not None:
+                    raise item
+                return
+            
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+class _Prepended():
+    """
+    Minimal read-only file object that returns some already consumed bytes
+    before the rest of the wrapped file (pickle needs read and readline).
+    """
+    def __init__(self, head, file):
+        self.head = head
+        self.file = file
+    
+    def read(self, size=-1):
+        
+        if not self.head:
+            return self.file.read(size)
+        
+        if size < 0:
+            data, self.head = self.head + self.file.read(), b""
+            return data
+        
+        data, self.head = self.head[:size], self.head[size:]
+        
+        if len(data) < size:
+            data += self.file.read(size - len(data))
+        
+        return data
+    
+    def readline(self):
+        
+        if not self.head:
+            return self.file.readline()
+        
+        nl = self.head.find(b"\n")
+        
+        if nl >= 0:
+            data, self.head = self.head[:nl+1], self.head[nl+1:]
+            return data
+        
+        data, self.head = self.head, b""
+        
+        return data + self.file.readline()
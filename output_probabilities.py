@@ -6,221 +6,380 @@ infection spread based on agents "meeting tables" pre-generated by the
 generateMeetings.py script. Please run these scripts in the correct order.
 """
 import argparse 
-import tarfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing, nullcontext
 from tqdm import tqdm 
+from meet_table import iter_steps, iter_timelines, record_durations
+import multiprocessing
 import numpy as np
 import os
-import pandas as pd
-import pickle
 import sys
 import yaml
 from entities import generate_infection_entities
+from entities import InfectionArrays
 from entities import init_infect
-from parsing import find_table_config_pairs
-from plotting import distribution_plot, linear_plot
+from parsing import config_tag, find_table_config_pairs
+from profiling import NullProfiler, Profiler
+from results import DailyResults, write_table
+from results_store import open_store, save_run
 
-"""
-Read command line option specifying which file(s) should be processed
-
-"""
-parser = argparse.ArgumentParser()
-group = parser.add_argument_group()
-group.add_argument('--all', action='store_true', 
-                    help='Generate output probabilities for all meeting \
-                          table files in the output/meeting_tables folder',)
-group.add_argument('-n', '--name', default='',
-                    help='Specify part of a meeting table / config filename \
-                          you wish output probabilities to be computed for.')
-group_rewrite = parser.add_argument_group()
-group_rewrite.add_argument('--rewrite', action='store_true',
-                         help='Fully rewrite all_stats.csv file instead of \
-                               appending to it.')
-group_massrun = parser.add_argument_group()
-group_massrun.add_argument('--config', default='',
-                           help='Specify a full path to a configuration file \
-                                 deployed for this computation run.')
-group_massrun.add_argument('--meet-table', default='',
-                           help='Specify a full path to a meeting table used \
-                                 as a basis for this computation run.')
-args = parser.parse_args()
 
-if not (args.all or args.name or args.config or args.meet_table):
+def parse_args(argv=None):
+    """
+    Read command line option specifying which file(s) should be processed
+    
+    """
+    parser = argparse.ArgumentParser()
+    group = parser.add_argument_group()
+    group.add_argument('--all', action='store_true', 
+                       help='Generate output probabilities for all meeting \
+                             table files in the output/meeting_tables folder',)
+    group.add_argument('-n', '--name', default='',
+                       help='Specify part of a meeting table / config \
+                             filename you wish output probabilities to be \
+                             computed for.')
+    group_rewrite = parser.add_argument_group()
+    group_rewrite.add_argument('--rewrite', action='store_true',
+                               help='Replace the runs with the same tags in \
+                                     the results store instead of keeping \
+                                     them as earlier runs.')
+    group_massrun = parser.add_argument_group()
+    group_massrun.add_argument('--config', default='', nargs='+',
+                               help='Specify a full path to a configuration \
+                                     file deployed for this computation run. \
+                                     Several configs are computed upon the \
+                                     same meeting table (with the arrays \
+                                     engine in one pass over it).')
+    group_massrun.add_argument('--meet-table', default='',
+                               help='Specify a full path to a meeting table \
+                                     used as a basis for this computation \
+                                     run.')
+    group_engine = parser.add_argument_group()
+    group_engine.add_argument('--engine', default='objects',
+                              choices=['objects', 'arrays'],
+                              help='Compute the infection per meeting with \
+                                    agent objects or per timestep with numpy \
+                                    arrays')
+    group_engine.add_argument('--profile', action='store_true',
+                              help='Time the phases of the infection \
+                                    calculation and count meetings (a \
+                                    report is saved to output/profiles)')
+    group_output = parser.add_argument_group()
+    group_output.add_argument('--no-plots', action='store_true',
+                              help='Write the statistics only (summary.txt \
+                                    and the results store) without plotting \
+                                    the figures, the plotting libraries are \
+                                    not even loaded then')
+    group_output.add_argument('--fig-format', default='pdf',
+                              choices=['pdf', 'png', 'svg'],
+                              help='File format of the figures')
+    group_output.add_argument('--fig-workers', type=int, default=None,
+                              help='Number of worker processes plotting the \
+                                    figures while the computation goes on \
+                                    (default: all cores but one, 0: plot \
+                                    in this process)')
+    args = parser.parse_args(argv)
+    
+    if not (args.all or args.name or args.config or args.meet_table):
         print('\nEither --all or --name or (--config together with',
               '--meet-table) must be specified.',
               'The program either tries to process all possible',
               'config-meeting table pairs, or searches ones with some',
-              'specific pattern in filenames (--name option) or just processes',
-              'a particular config/meeting table pair with full path',
-              'specified for both of them (that one is useful for mass-runs)',
-              'via an orchestrating bash script.',
+              'specific pattern in filenames (--name option) or just',
+              'processes a particular config/meeting table pair with full',
+              'path specified for both of them (that one is useful for',
+              'mass-runs) via an orchestrating bash script.',
               '\n')
         sys.exit(1)
-if args.all and args.name:
-    print('\nIt should be either all config/meet tables or the ones with some',
-          'specific pattern in their name (-n == --name option). Make your',
-          'choice.',
-          '\n')
-    sys.exit(1)
-if (bool(args.config) ^ bool(args.meet_table)): # either both or none
-    print('\nSpecify both config and meeting table paths. This is the most',
-          'manual way of running this program and there both options must',
-          'be specified.',
-          '\n')
-    sys.exit(1)
-
-"""
-Safety check if the scripts have been run in the correct order
-
-"""
-if not os.path.exists("output"):
-    print(("\nAn 'output' folder is not detected"
-           " in the root folder of the project."
-           " Please run the generateMeetings.py file first.\n"))
-    sys.exit(1)
-
-"""
-Setup folders to take information for infection spread calculation
-             and to store outputs for each set on input conditions
-"""
-paths = {"configs"     : os.path.join("output", "configs"),
-         "meet_tables" : os.path.join("output", "meetings_tables"),
-         "out_stats"   : os.path.join("output", "stat_results")}
-
-"""
-Search for files with speified pattern in filename to process (or just read
-full paths from options). 
+    if args.all and args.name:
+        print('\nIt should be either all config/meet tables or the ones with',
+              'some specific pattern in their name (-n == --name option).',
+              'Make your choice.',
+              '\n')
+        sys.exit(1)
+    if (bool(args.config) ^ bool(args.meet_table)): # either both or none
+        print('\nSpecify both config and meeting table paths. This is the',
+              'most manual way of running this program and there both',
+              'options must be specified.',
+              '\n')
+        sys.exit(1)
+    
+    return args
 
-"""
-if args.all or args.name:
 
-    if args.all:
+def main(args):
+    """
+    Safety check if the scripts have been run in the correct order
+    
+    """
+    if not os.path.exists("output"):
+        print(("\nAn 'output' folder is not detected"
+               " in the root folder of the project."
+               " Please run the generateMeetings.py file first.\n"))
+        sys.exit(1)
+    
+    """
+    Setup folders to take information for infection spread calculation
+                 and to store outputs for each set on input conditions
+    """
+    paths = {"configs"     : os.path.join("output", "configs"),
+             "meet_tables" : os.path.join("output", "meetings_tables"),
+             "out_stats"   : os.path.join("output", "stat_results")}
+    
+    """
+    Search for files with speified pattern in filename to process (or just read
+    full paths from options). 
+    
+    """
+    if args.all or args.name:
+        
+        if args.all:
+            tag = ''
+        if args.name:
+            tag = args.name
+        
+        path_pairs = find_table_config_pairs(tag, paths)
+    
+    #sys.exit(0)
+    
+    if args.config and args.meet_table:
+        # from e.g. 'config_mytag_10:11:12.yaml' filename leave just 'mytag'
+        path_pairs = [{
+            'config' : config_path,
+            'meet_table' : args.meet_table,
+            'tag' : config_tag(config_path),
+            } for config_path in args.config]
+        
+        tags = [path_pair['tag'] for path_pair in path_pairs]
+        
+        if '' in tags or len(set(tags)) < len(tags):
+            print('\nThe configs must have distinct non-empty tags (the',
+                  'filename without the "config_" prefix and the extension),',
+                  'their results are saved under them. Tags of the given',
+                  f'configs: {tags}',
+                  '\n')
+            sys.exit(1)
+        
+        # results of each config are saved under its own tag
         tag = ''
-    if args.name:
-        tag = args.name
-
-    path_pairs = find_table_config_pairs(tag, paths)
-
-#sys.exit(0)
-
-if args.config and args.meet_table:
-    # from e.g. 'config_mytag_10:11:12.yaml' filename leave just 'mytag'
-    tag = os.path.basename(args.config)[7:-5]
-    path_pairs = [{
-        'config' : args.config,
-        'meet_table' : args.meet_table,
-        'tag' : tag,
-        }]
-
-if not path_pairs:
-    print("Are you sure that output files with specified tag exist?")
-    sys.exit(1)
-else: 
-    print(f"Found {len(path_pairs)} [meet_table, config] pairs")
-
-"""
-Specify meta-file for statistics from all runs to be summarized in.
-
-"""    
-common_damp_path = os.path.join(paths['out_stats'], 'all_stats.csv')
-
-if args.rewrite:
-    with open(common_damp_path, "w") as file:
-        line = ("tag"       "\t"
-                "peak_sympt""\t"
-                "had_disease")
-        file.write(line) # headline for a tab-separated csv with results
-
-# for each set of initial conditions originally defined in the config file
-for i, path_pair in enumerate(path_pairs): 
     
-    results_foldername = tag if tag else path_pair['tag']
+    if not path_pairs:
+        print("Are you sure that output files with specified tag exist?")
+        sys.exit(1)
+    else: 
+        print(f"Found {len(path_pairs)} [meet_table, config] pairs")
     
-    out_path = os.path.join("output/stat_results", results_foldername)
-    if not os.path.exists(out_path):
-        os.makedirs(out_path)
+    # pairs with the same meeting table are computed together (scenarios of
+    # the arrays engine), the objects engine computes pairs one by one
+    groups = []
+    
+    for path_pair in path_pairs:
+        
+        if (args.engine == "arrays" and groups
+            and groups[-1][0]['meet_table'] == path_pair['meet_table']):
+            
+            groups[-1].append(path_pair)
+        else:
+            groups.append([path_pair])
     
-    print(f"Pair {i+1} name: \"{path_pair['tag']}\"")
+    all_stats = []
     
-    with open(path_pair['config']) as file:
-        config = yaml.load(file, Loader=yaml.FullLoader)
+    figures = [] # futures of the figures plotted by the pool workers
     
-    timelines = []
-    with tarfile.open(path_pair['meet_table'], "r:bz2") as tar:
-        print('Loading meetings file . .')
-        for member in tar:
-            file = tar.extractfile(member)
-            while True:
-                try:
-                    timelines.append(pickle.load(file))
-                except EOFError:
-                    break
+    pair_n = 0
     
     """
-    Compute infection spread (probabilities of infection states for each agent
-                                                                 for each day)
+    Statistics from all runs are saved to one results store (see
+    results_store.py), concurrent runs write to it safely.
+    
     """
-    agents = generate_infection_entities(config)
+    with closing(open_store()) as store, figures_pool(args) as pool:
+        
+        for group in groups:
+            
+            for path_pair in group:
+                pair_n += 1
+                print(f"Pair {pair_n} name: \"{path_pair['tag']}\"")
+            
+            computed = compute_infection(group, args)
+            
+            # for each set of initial conditions originally defined in the
+            # config
+            for path_pair, (config, agents, results) in zip(group, computed):
+                
+                results_foldername = tag if tag else path_pair['tag']
+                
+                out_path = os.path.join("output/stat_results",
+                                        results_foldername)
+                if not os.path.exists(out_path):
+                    os.makedirs(out_path)
+                
+                stats, pair_figures = report_pair(
+                    path_pair, config, agents, results, out_path, store,
+                    args, pool=pool)
+                
+                all_stats.append(stats)
+                figures += pair_figures
+        
+        
+        # errors of the figure workers are raised here
+        for future in figures:
+            future.result()
     
-    init_infect(agents, config)
+    return all_stats
+
+
+def compute_infection(path_pairs, args):
+    """
+    Compute infection spread (probabilities of infection states for each agent
+    for each day) for config / meeting table pairs with the same meeting table.
+    The arrays engine evolves all of them in one pass over the table.
+    Out:
+        list with (config, agents, results) tuples, one for each pair, where
+        results is a DailyResults instance
+    """
+    profiler = Profiler() if args.profile else NullProfiler()
     
-    data = {"day"    : [],
-            "status" : [],
-            "inf_p"  : [],
-            "imm_p"  : [],}
+    scenarios = []
     
-    for timeline in tqdm(timelines):
+    for path_pair in path_pairs:
+        
+        with open(path_pair['config']) as file:
+            config = yaml.load(file, Loader=yaml.FullLoader)
+        
+        with profiler.phase("generate_entities"):
+            
+            agents = generate_infection_entities(config)
+            
+            init_infect(agents, config)
         
-        ts, meets = timeline['timestamp'], timeline['meetings']
+        scenarios.append((agents, config))
+    
+    meet_table = path_pairs[0]['meet_table']
+    
+    # timelines are streamed from the table while the infection is computed
+    if args.engine == "arrays":
+        with profiler.phase("generate_entities"):
+            engine = InfectionArrays(scenarios)
+        timelines = iter_steps(meet_table)
+    else:
+        [(agents, config)] = scenarios
+        timelines = iter_timelines(meet_table)
+    
+    results = [DailyResults([agent.conscripted for agent in agents],
+                            config['simulationDuration'])
+               for agents, config in scenarios]
+    
+    # the time spent waiting for the table reading and decoding counts
+    for timeline in tqdm(profiler.timed(timelines, "read")):
         
-        for link, place in meets.items():
+        if args.engine == "arrays":
+            
+            # all meetings of the timestep at once
+            ts, records, places = timeline
             
-            link = tuple(link)
+            with profiler.phase("meet"):
+                engine.meet(ts, records["agent_a"], records["agent_b"],
+                            records["place"], places,
+                            record_durations(records))
             
-            ag_0 = agents[link[0]]
-            ag_1 = agents[link[1]]
+            profiler.count("meetings", len(records))
+        else:
+            ts, meets = timeline
             
-            if np.random.rand() > ag_0.meets_dropout:
+            update = profiler.phase("update")
+            transfer = profiler.phase("transfer")
             
-                ag_0.infection.update(ts, ag_0, place, config)
-                ag_1.infection.update(ts, ag_1, place, config)
+            # durations are known for interval tables only
+            for idx_0, idx_1, place, duration in meets:
                 
-                ag_0.infection.transfer(ts, ag_1)
-                ag_1.infection.transfer(ts, ag_0)
+                ag_0 = agents[idx_0]
+                ag_1 = agents[idx_1]
                 
-                ag_0.meetings_n += 1
-                ag_1.meetings_n += 1
+                if np.random.rand() > ag_0.meets_dropout:
+                    
+                    with update:
+                        ag_0.infection.update(ts, ag_0, place, config)
+                        ag_1.infection.update(ts, ag_1, place, config)
+                    
+                    with transfer:
+                        ag_0.infection.transfer(ts, ag_1, duration)
+                        ag_1.infection.transfer(ts, ag_0, duration)
+                    
+                    ag_0.meetings_n += 1
+                    ag_1.meetings_n += 1
+            
+            profiler.count("meetings", len(meets))
         
         day_n = ts//(24*60*60) + 1
         
-        if len(data['day']) < day_n*len(agents):
-        
-            for agent in agents:
-                
-                inf = agent.infection.parts_inf.values()
-                inf = sum( list(inf) )
-                
-                imm = agent.infection.parts_imm.values()
-                imm = sum( list(imm) )
-                
-                data["inf_p"].append(inf)
-                data["imm_p"].append(imm)
+        if results[0].n_recorded < day_n:
+            
+            with profiler.phase("record_day"):
+                if args.engine == "arrays":
+                    for k, scenario_results in enumerate(results):
+                        scenario_results.record(
+                            day_n, engine.scenario(engine.inf_p, k),
+                                   engine.scenario(engine.imm_p, k))
+                else:
+                    # agents develop on their meetings only, those without
+                    # any of late are brought to the current time (as the
+                    # arrays engine does for all agents)
+                    for agent in agents:
+                        agent.infection.develop(ts)
                     
-                if agent.conscripted:
+                    inf = [agent.infection.inf_p for agent in agents]
+                    imm = [agent.infection.imm_p for agent in agents]
                     
-                    data['status'].append('mil')
-                else:
-                    data['status'].append('civ')
-            
-                data["day"].append(day_n)
+                    results[0].record(day_n, inf, imm)
+        
+        profiler.step()
     
-    """
-    Save computed infection spread in the dataframe
+    if args.engine == "arrays":
+        for k, (agents, _) in enumerate(scenarios):
+            engine.store_stats(agents, k)
+    
+    profiler.save(os.path.join("output", "profiles", "profile_infection_"
+                               + path_pairs[0]['tag'] +".json"))
     
+    return [(config, agents, scenario_results) for (agents, config),
+            scenario_results in zip(scenarios, results)]
+
+
+def figures_pool(args):
+    """
+    Out:
+        pool of worker processes to plot the figures in, or a null context
+        (None) if they are plotted in this process or not at all
     """
-    df = pd.DataFrame(data=data)
+    workers = args.fig_workers
     
-    #del(data)
+    # by default all cores but the one computing the infection
+    if workers is None:
+        workers = (os.cpu_count() or 1) - 1
     
+    if args.no_plots or workers < 1:
+        return nullcontext()
+    
+    # the workers are forked from a server process which has loaded the
+    # plotting libraries once
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["plotting"])
+    
+    return ProcessPoolExecutor(workers, mp_context=context)
+
+
+def report_pair(path_pair, config, agents, results, out_path, store, args,
+                pool=None):
+    """
+    Save the summary and the daily statistics (daily_stats.csv) of one
+    config / meeting table pair to out_path, save the run with its
+    parameters, daily statistics and primary statistics to the results
+    store and plot its figures (unless --no-plots, see plot_pair).
+    Out:
+        dict with the primary statistics and the list of futures of the
+        figures plotted by the pool workers
+    """
     """
     Segregate conscripts and civilians for separate stats clculation
     
@@ -251,28 +410,11 @@ for i, path_pair in enumerate(path_pairs):
                "value is less or equal to the 'simulationDuration'"
                "number of days"))
     
-    top_inf, max_inf, sum_inf = 0, 0, 0
+    stats = results.stats(n_days)
+    
+    max_inf = stats["max_inf"]
+    sum_inf = stats["sum_inf"]
     
-    for n_day in range(0, n_days):
-        
-        n_day += 1 # maintain the possibility to run single-day simulations
-        
-        infs_df = df[(df.day == n_day)].inf_p
-        
-        top_inf = max(top_inf, np.average(infs_df))
-        
-        infs_df = df[(df.status == "mil") & (df.day == n_day)].inf_p
-        
-        avg_inf = np.average(infs_df)
-        
-        if avg_inf >= max_inf:
-            
-            max_inf = avg_inf
-            
-            at_peak_day_df = infs_df
-        
-        sum_inf += avg_inf
-        
     lower_bound = config["infection"]["acute"]["daysMin"]
     upper_bound = config["infection"]["acute"]["daysMax"]
     
@@ -302,12 +444,75 @@ for i, path_pair in enumerate(path_pairs):
     
     
     """
-    Dataframe with better name fields for out-of-the-box seaborn plotting
+    Per-day means and quantiles of conscripts and civilians, the figures
+    are plotted from this compact table
+    """
+    daily = results.daily_summary()
+    
+    write_table(daily, os.path.join(out_path, "daily_stats.csv"))
+    
+    """
+    Write the primary simulation results for a given set of initial conditions 
+    to the all-collecting results store, in one transaction (before the
+    figures, so that a plotting error does not lose them). 
+    """
+    primary = {"tag"               : path_pair['tag'],
+               "had_disease"       : undergone_inf,
+               "peak_inf"          : max_inf,
+               "peak_sympt"        : max_sympt,
+               "top_inf"           : stats["top_inf"],
+               "meets_per_day_mil" : meets_per_day_mil,
+               "meets_per_day_civ" : meets_per_day_civ}
+    
+    save_run(store, path_pair['tag'], config, primary, daily,
+             replace=args.rewrite, config_path=path_pair['config'],
+             meet_table=path_pair['meet_table'], engine=args.engine)
+    
+    if not args.no_plots:
+        figures = plot_pair(config, agents, stats, daily, out_path,
+                            meets_per_day_civ, meets_per_day_mil,
+                            args.fig_format, pool)
+    else:
+        figures = []
+    
+    return primary, figures
+
+
+def plot_figure(name, kwargs):
+    """
+    Plot one figure with the plotting function name (in a pool worker or in
+    this process).
+    """
+    # the plotting libraries are loaded only when there is something to plot
+    import plotting
+    
+    getattr(plotting, name)(**kwargs)
+
+
+def plot_pair(config, agents, stats, daily, out_path,
+              meets_per_day_civ, meets_per_day_mil, fig_format="pdf",
+              pool=None):
+    """
+    Plot and save the figures of one config / meeting table pair to out_path.
+    The figures get compact data only (the daily table and per agent arrays),
+    so that they can be plotted by the pool workers concurrently.
+    Out:
+        list of futures of the figures (empty if plotted in this process)
     """
-    df_n = df.rename(columns={'status': 'Type', 
-                                  'inf_p' : 'Infected population fraction', 
-                                  'imm_p' : 'Immune population fraction', 
-                                  'day'   : 'Day'})
+    futures = []
+    
+    def plot(name, **kwargs):
+        
+        kwargs.update(save_path=out_path, fig_format=fig_format)
+        
+        if pool is None:
+            plot_figure(name, kwargs)
+        else:
+            futures.append(pool.submit(plot_figure, name, kwargs))
+    
+    n_days = config["outputStatsFor"]
+    
+    top_inf = stats["top_inf"]
     
     mu    = config["movementSpeed"][   "mu"]
     sigma = config["movementSpeed"]["sigma"]
@@ -341,117 +546,85 @@ for i, path_pair in enumerate(path_pairs):
     # visual comparison. E.g. border right at 10, 20, 30% etc.
     ylim = (top_inf+0.05)//0.05*0.05 # 0.05 for 5% step.
     
-    linear_plot(fig_n:=fig_n+1, df_n, 
-                x_column="Day", y_column='Infected population fraction',
-                xlim=config['outputStatsFor'], 
-                ylim=ylim, y_ticks_major_minor=(0.05, 0.01),
-                title=(f"Infection spread" f"{title_tag}"),
-                fig_name="infection", save_path=out_path)
-
+    plot("linear_plot", fig_n=(fig_n:=fig_n+1), data=daily,
+         x_column="day", y_column="inf_p",
+         x_label="Day", y_label='Infected population fraction',
+         xlim=config['outputStatsFor'], 
+         ylim=ylim, y_ticks_major_minor=(0.05, 0.01),
+         title=(f"Infection spread" f"{title_tag}"),
+         fig_name="infection")
+    
     """
     Plot and save the population immunity gain.
     
     """
-    linear_plot(fig_n:=fig_n+1, df_n, 
-                x_column="Day", y_column='Immune population fraction',
-                xlim=config['outputStatsFor'],
-                ylim=1.0, y_ticks_major_minor=(0.10, 0.02),
-                title=(f"Immunity gain" f"{title_tag}"),
-                fig_name="immunity", save_path=out_path)
+    plot("linear_plot", fig_n=(fig_n:=fig_n+1), data=daily,
+         x_column="day", y_column="imm_p",
+         x_label="Day", y_label='Immune population fraction',
+         xlim=config['outputStatsFor'],
+         ylim=1.0, y_ticks_major_minor=(0.10, 0.02),
+         title=(f"Immunity gain" f"{title_tag}"),
+         fig_name="immunity")
     
     
     """
     Plot the infected people distribution at the peak of pandemic
     """
-    distribution_plot(
-        fig_n:=fig_n+1, at_peak_day_df, 
-        x_label="Probability of being infected",
-        y_label="Number of conscripts",
-        title=('Infection probability distribution among'
-               '\nconscripts at the peak of the pandemic.'  
-               f"{title_tag}"),
-        fig_name="infection_distribution_at_peak", 
-        save_path=out_path)
+    plot("distribution_plot", fig_n=(fig_n:=fig_n+1), data=stats["at_peak"],
+         x_label="Probability of being infected",
+         y_label="Number of conscripts",
+         title=('Infection probability distribution among'
+                '\nconscripts at the peak of the pandemic.'  
+                f"{title_tag}"),
+         fig_name="infection_distribution_at_peak")
     
     """
     Histograms for average meetings per day and transmitted infection Prob.
     First for conscripts, then for civilians
     """
-    # conscripts
-    data = {"meets_n"    : [],
-            "spread_inf" : [],}
+    conscripted = np.array([agent.conscripted for agent in agents])
     
-    for agent in agents:
-        
-        if agent.conscripted:
-            data[   "meets_n"].append(agent.meetings_n )
-            data["spread_inf"].append(agent.infection_transmitted)
-        
-    spread_df = pd.DataFrame(data=data)
+    meets_n    = np.array([agent.meetings_n for agent in agents], dtype=float)
+    spread_inf = np.array([agent.infection_transmitted for agent in agents],
+                          dtype=float)
     
     print(out_path)
     
-    avg_daily_meets = spread_df["meets_n"] / n_days
-    
-    distribution_plot(
-        fig_n:=fig_n+1, avg_daily_meets,
-        x_label="Average meetings per day",
-        y_label="Number of conscripts",
-        title=("Conscript meetings count distribution" f"{title_tag}"),
-        fig_name="conscript_meetings_distribution", 
-        save_path=out_path)
-    
-    distribution_plot(
-        fig_n:=fig_n+1, spread_df["spread_inf"], 
-        x_label="Cummulative infection probability transmitted",
-        y_label="Number of conscripts with such spreading rating",
-        title=('\"Amount of infection\" spread by conscripts' f"{title_tag}"),
-        fig_name="conscript_infection_transmitted", 
-        save_path=out_path)
-
-    # civilians
-    data = {"meets_n"    : [],
-            "spread_inf" : [],}
-    
-    for agent in agents:
-        
-        if not agent.conscripted:
-            data[   "meets_n"].append(agent.meetings_n )
-            data["spread_inf"].append(agent.infection_transmitted)
-        
-    spread_df = pd.DataFrame(data=data)
-    
-    
-    avg_daily_meets = spread_df["meets_n"] / n_days
-    
-    distribution_plot(
-        fig_n:=fig_n+1, avg_daily_meets,
-        x_label="Average meetings per day",
-        y_label="Number of civilians",
-        title=('Civilian meetings count distribution' f"{title_tag}"),
-        fig_name="civilian_meetings_distribution", 
-        save_path=out_path)
-    
-    distribution_plot(
-        fig_n:=fig_n+1, spread_df["spread_inf"], 
-        x_label="Cummulative infection probability transmitted",
-        y_label="Number of civilians with such spreading rating",
-        title=('\"Amount of infection\" spread by civilians' f"{title_tag}"),
-        fig_name="civilian_infection_transmitted", 
-        save_path=out_path)
-    
-    """
-    Write the primary simulation results for a given set of initial conditions 
-    to an all-collecting results file. 
-    """
-    
-    line = f"\n{path_pair['tag']}\t{max_sympt}\t{undergone_inf}"
+    # conscripts
+    plot("distribution_plot", fig_n=(fig_n:=fig_n+1),
+         data=meets_n[conscripted] / n_days,
+         x_label="Average meetings per day",
+         y_label="Number of conscripts",
+         title=("Conscript meetings count distribution" f"{title_tag}"),
+         fig_name="conscript_meetings_distribution")
+    
+    plot("distribution_plot", fig_n=(fig_n:=fig_n+1),
+         data=spread_inf[conscripted],
+         x_label="Cummulative infection probability transmitted",
+         y_label="Number of conscripts with such spreading rating",
+         title=('\"Amount of infection\" spread by conscripts' f"{title_tag}"),
+         fig_name="conscript_infection_transmitted")
     
-    with open(common_damp_path, "a") as file:
-        
-        file.write(line) # one line with primary stats 
-                         # for each set of conditions
-        
+    # civilians
+    plot("distribution_plot", fig_n=(fig_n:=fig_n+1),
+         data=meets_n[~conscripted] / n_days,
+         x_label="Average meetings per day",
+         y_label="Number of civilians",
+         title=('Civilian meetings count distribution' f"{title_tag}"),
+         fig_name="civilian_meetings_distribution")
+    
+    plot("distribution_plot", fig_n=(fig_n:=fig_n+1),
+         data=spread_inf[~conscripted],
+         x_label="Cummulative infection probability transmitted",
+         y_label="Number of civilians with such spreading rating",
+         title=('\"Amount of infection\" spread by civilians' f"{title_tag}"),
+         fig_name="civilian_infection_transmitted")
+    
+    return futures
+
+if __name__ == "__main__":
+    main(parse_args())
+
 
 
 
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file contains the config compiled into parameter objects. The config
+values read from the yaml may be numbers or arithmetic expressions of numbers
+(e.g. "(246.6+10)*2"), which are evaluated once, when the config is compiled,
+and checked for sensible ranges. Only numbers and arithmetic operators are
+allowed in the expressions, anything else is reported as a config error.
+Hence the entities generation reads plain numbers from the parameter objects
+instead of evaluating the config values for every agent.
+"""
+import ast
+import operator
+
+# arithmetic operators allowed in the config expressions
+BINARY_OPERATORS = {ast.Add      : operator.add,
+                    ast.Sub      : operator.sub,
+                    ast.Mult     : operator.mul,
+                    ast.Div      : operator.truediv,
+                    ast.FloorDiv : operator.floordiv,
+                    ast.Mod      : operator.mod,
+                    ast.Pow      : operator.pow}
+
+UNARY_OPERATORS = {ast.UAdd : operator.pos,
+                   ast.USub : operator.neg}
+
+
+def evaluate(value, key=""):
+    """
+    Args:
+        value: number or string with an arithmetic expression of numbers
+        key: config key of the value (for the error message)
+    Out:
+        number
+    """
+    if isinstance(value, (int, float)):
+        return value
+    
+    try:
+        tree = ast.parse(str(value).strip(), mode='eval')
+        
+        return evaluate_node(tree.body)
+    
+    except (SyntaxError, ValueError, ArithmeticError) as e:
+        raise ValueError(f"Config value {key}: {value!r} is not a number or "
+                         f"an arithmetic expression ({e})") from None
+
+
+def evaluate_node(node):
+    
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        return node.value
+    
+    if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+        return BINARY_OPERATORS[type(node.op)](evaluate_node(node.left),
+                                               evaluate_node(node.right))
+    
+    if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPERATORS:
+        return UNARY_OPERATORS[type(node.op)](evaluate_node(node.operand))
+    
+    raise ValueError(f"{ast.unparse(node)!r} is not allowed")
+
+
+def number(config, *keys, default=None, low=None, high=None):
+    """
+    Args:
+        config: config dict read from the yaml
+        keys: path to the value, e.g. "infection", "acute", "daysMin"
+        default: value of a missing key (the key is required if None)
+        low, high: inclusive bounds of the value
+    Out:
+        evaluated value
+    """
+    key = ".".join(keys)
+    
+    value = config
+    
+    for k in keys:
+        if k not in value and default is not None:
+            return default
+        value = value[k]
+    
+    value = evaluate(value, key)
+    
+    if ((low is not None and value < low)
+        or (high is not None and value > high)):
+        raise ValueError(f"Config value {key}: {value} is out of the range "
+                         f"[{low}, {high}]")
+    
+    return value
+
+
+def days_range(config, *keys):
+    """
+    Out:
+        (daysMin, daysMax) tuple of a disease stage
+    """
+    low  = number(config, *keys, "daysMin", low=0)
+    high = number(config, *keys, "daysMax", low=low)
+    
+    return low, high
+
+
+class TeamParams():
+    def __init__(self, name, team_conf, config):
+        """
+        Parameters of one team of the config. A team with repeat is spawned
+        times times, each copy in its own box shifted by separation along x.
+        """
+        path = ("teams", name)
+        
+        self.name = name
+        self.conscripted = bool(team_conf["conscripted"])
+        
+        self.n_agents = int(number(config, *path, "nAgents", low=0))
+        
+        self.times      = int(number(config, *path, "repeat", "times",
+                                     default=1, low=1))
+        self.separation = number(config, *path, "repeat", "spatialSeparation",
+                                 default=0)
+        
+        # home box dimensions and its top left point, meters
+        self.width  = number(config, *path, "homeBox", "width",  low=0)
+        self.height = number(config, *path, "homeBox", "height", low=0)
+        
+        self.x = number(config, *path, "homeBox", "topLeftPoint", "x")
+        self.y = number(config, *path, "homeBox", "topLeftPoint", "y")
+        
+        # days of the service rotation (conscripts only)
+        if self.conscripted:
+            self.duty = {"on"     : number(config, "daysOnDuty",  low=0),
+                         "off"    : number(config, "daysOffDuty", low=0),
+                         "offset" : number(config, *path, "rotationOffset")}
+        else:
+            self.duty = None
+
+
+class GroupParams():
+    def __init__(self, config, conscripted):
+        """
+        Infection countermeasures of conscripts (military) or civilians.
+        """
+        if conscripted:
+            group, quarantine = "military", "militaryQuarantine"
+        else:
+            group, quarantine = "civilian", "civilianSelfQuarantine"
+        
+        # chance of wearing a mask
+        self.mask_p = number(config, "mask", "coverage", group, low=0, high=1)
+        
+        # chances to enter quarantine after being merely exposed or after
+        # developing symptoms, and its effectiveness
+        if config[quarantine]["use"]:
+            self.quar_x_p = number(config, quarantine,
+                                   "chanceToEnterIfExposed", low=0, high=1)
+            self.quar_s_p = number(config, quarantine,
+                                   "chenceToEnterIfSymptoms", low=0, high=1)
+            self.quar_eff = number(config, quarantine, "effectiveness",
+                                   low=0, high=1)
+        else:
+            self.quar_x_p = self.quar_s_p = self.quar_eff = 0.0
+        
+        # fraction of meetings excluded from infection transmission
+        self.meets_dropout = number(config, "meetingsAvoided", group,
+                                    low=0, high=1)
+
+
+class ConfigParams():
+    def __init__(self, config):
+        """
+        All parameters the entities are generated from, see compile_config.
+        """
+        self.teams = [TeamParams(name, team_conf, config)
+                      for name, team_conf in config["teams"].items()]
+        
+        self.n_agents = sum(team.n_agents * team.times for team in self.teams)
+        
+        """
+        Spatial part
+        """
+        # seconds in simulation step
+        self.dt = number(config, "minSimulationStep", low=0)
+        
+        # agents movement speed (normal distribution), meters per day
+        self.speed_mu    = number(config, "movementSpeed", "mu", low=0)
+        self.speed_sigma = number(config, "movementSpeed", "sigma",
+                                  low=0) * self.speed_mu
+        
+        """
+        Infection part
+        """
+        # bits merging window and the contact duration, seconds
+        self.merge_within = number(config, "infection", "mergeBitsHours",
+                                   default=0, low=0) * 60*60
+        self.contact_secs = number(config, "infection", "contactMinutes",
+                                   default=0, low=0) * 60
+        
+        # (min, max) durations of the disease stages, days
+        self.inc_days = days_range(config, "infection", "incubating")
+        self.psy_days = days_range(config, "infection", "preSymptomatic")
+        self.inf_days = days_range(config, "infection", "acute")
+        
+        self.asymt_p = number(config, "infection", "asymptomatic", "chance",
+                              low=0, high=1)
+        
+        # infection transfer probabilities of the stages
+        self.incub_trx = number(config, "infection", "incubating",
+                                "contagious", low=0, high=1)
+        self.psymt_trx = number(config, "infection", "preSymptomatic",
+                                "contagious", low=0, high=1)
+        self.sympt_trx = number(config, "infection", "acute",
+                                "contagious", low=0, high=1)
+        self.asymt_trx = number(config, "infection", "asymptomatic",
+                                "contagious", low=0, high=1)
+        
+        # mask effectiveness for the wearer and for the recipient
+        self.mask_eff_tx = number(config, "mask", "effectiveness", "wearer",
+                                  low=0, high=1)
+        self.mask_eff_rx = number(config, "mask", "effectiveness",
+                                  "recipient", low=0, high=1)
+        
+        # countermeasures of conscripts and civilians
+        self.groups = {True  : GroupParams(config, conscripted=True),
+                       False : GroupParams(config, conscripted=False)}
+
+
+def compile_config(config):
+    """
+    Args:
+        config: config dict read from the yaml
+    Out:
+        ConfigParams instance, raises ValueError on an invalid config value
+    """
+    return ConfigParams(config)
@@ -5,6 +5,21 @@
 """
 import os
 
+def config_tag(config_path):
+    """
+    Args:
+        str config_path: path to a config file
+    Out:
+        str tag: e.g. 'mytag' of 'config_mytag.yaml' (or of 'mytag.yaml')
+    """
+    name = os.path.splitext(os.path.basename(config_path))[0]
+    
+    if name.startswith('config_'):
+        name = name[len('config_'):]
+    
+    return name
+
+
 def find_table_config_pairs(tag, paths):
     """
     Args:
@@ -17,6 +32,9 @@ def find_table_config_pairs(tag, paths):
     aa = os.listdir(paths[    "configs"])
     bb = os.listdir(paths["meet_tables"])
     
+    # unfinished tables are still being written (or their run was killed)
+    bb = [b for b in bb if not b.endswith(".part")]
+    
     path_pairs = []
     
     for a in aa: # only few files, so nested loop is ok
@@ -39,7 +57,7 @@ def find_table_config_pairs(tag, paths):
                     path_pairs.append(path_pair)
     
     # alphabetically sort pairs according to the user provided tag name
-    # (allows adding stat lines to all_stats.csv in sensible order)
+    # (allows storing the runs stats in sensible order)
     path_pairs = sorted(path_pairs, key=lambda entry: entry['tag'])
     
     return path_pairs
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file contains the spatially partitioned meetings generation: boxes are
+split into partitions which are simulated by separate worker processes.
+
+Agents can meet only if they are closer than the infection radius, hence
+agents in boxes further apart than the radius never meet. Boxes closer than
+the radius are joined into groups, and whole groups are assigned to the
+partitions, so that no meeting crosses a partition border.
+
+The agents state (a SpatialState) is moved into shared memory. Each step
+the main process transfers agents between boxes (rotate_teams and
+queue_sotilaskoti, which draw all the random numbers), then every worker
+moves the agents which are currently in its boxes and finds meetings among
+them. An agent transferred to a box of another partition is thus migrated
+to that partition simply by its new box id in the shared arrays. Movement
+is deterministic, therefore the result is the same as of a serial run.
+"""
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+from updates import grid_close_pairs
+from updates import increment_state_positions
+
+# SpatialState arrays which are shared with the workers
+SHARED_ARRAYS = ("x", "y", "dx", "dy", "left", "right", "top", "bottom",
+                 "box_id")
+
+
+def box_groups(boxes, rad):
+    """
+    Join boxes closer to each other than rad into groups.
+    Args:
+        boxes: list with Box instances
+        rad: meeting radius
+    Out:
+        list with the group number of each box
+    """
+    group = list(range(len(boxes))) # union-find parents
+    
+    def root(i):
+        while group[i] != i:
+            group[i] = group[group[i]]
+            i = group[i]
+        return i
+    
+    for i, a in enumerate(boxes):
+        for j, b in enumerate(boxes[:i]):
+            
+            # gaps between the boxes along both ordinates (0 if overlapping)
+            gap_x = max(a.left - b.right, b.left - a.right, 0)
+            gap_y = max(a.bottom - b.top, b.bottom - a.top, 0)
+            
+            if np.hypot(gap_x, gap_y) <= rad:
+                group[root(i)] = root(j)
+    
+    return [root(i) for i in range(len(boxes))]
+
+
+def assign_partitions(boxes, weights, n_parts, rad):
+    """
+    Assign groups of boxes (see box_groups) to partitions, heaviest groups
+    first, each to the currently lightest partition.
+    Args:
+        boxes: list with Box instances
+        weights: list with the expected number of agents in each box
+        n_parts: number of partitions
+        rad: meeting radius
+    Out:
+        numpy array with the partition number of each box
+    """
+    groups = box_groups(boxes, rad)
+    
+    group_weight = dict()
+    
+    for group, weight in zip(groups, weights):
+        group_weight[group] = group_weight.get(group, 0) + weight
+    
+    load = [0] * n_parts
+    group_part = dict()
+    
+    for group in sorted(group_weight, key=lambda g: -group_weight[g]):
+        
+        part = load.index(min(load))
+        
+        group_part[group] = part
+        load[part] += group_weight[group]
+    
+    return np.array([group_part[group] for group in groups], dtype=np.int32)
+
+
+def share_state(state):
+    """
+    Move the SpatialState arrays into one shared memory block.
+    Out:
+        SharedMemory instance (to be released with release_state)
+    """
+    arrays = [getattr(state, name) for name in SHARED_ARRAYS]
+    
+    size = sum(array.nbytes for array in arrays)
+    
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    
+    offset = 0
+    
+    for name, array in zip(SHARED_ARRAYS, arrays):
+        
+        shared = np.ndarray(array.shape, array.dtype, shm.buf, offset)
+        shared[:] = array
+        
+        setattr(state, name, shared)
+        
+        offset += array.nbytes
+    
+    return shm
+
+
+def release_state(state, shm):
+    """
+    Copy the shared arrays back to the process memory and free the block.
+    """
+    for name in SHARED_ARRAYS:
+        setattr(state, name, getattr(state, name).copy())
+    
+    shm.close()
+    shm.unlink()
+
+
+def partition_worker(part, state, box_part, rad, conn):
+    """
+    Worker process loop. For each eval_time received through the pipe, move
+    the agents of the partition and send back the close pairs among them.
+    None ends the loop.
+    """
+    while (eval_time := conn.recv()) is not None:
+        
+        idx = np.flatnonzero(box_part[state.box_id] == part)
+        
+        increment_state_positions(state, idx)
+        
+        x, y = state.x[idx], state.y[idx]
+        
+        ia, ib = grid_close_pairs(x, y, rad)
+        
+        # the place is the box of the agent that is further along the x
+        later = np.where(x[ia] >= x[ib], ia, ib)
+        
+        conn.send((idx[ia], idx[ib], idx[later]))
+    
+    conn.close()
+
+
+class PartitionedSimulation():
+    
+    def __init__(self, state, teams, boxes, config, n_parts):
+        """
+        Start the worker processes.
+        - state is the SpatialState of all agents (the "arrays" engine)
+        - teams and boxes are the ones from generate_spatial_entities
+        - n_parts is the number of partitions (worker processes)
+        """
+        self.state = state
+        
+        # all boxes get their ids before the partitions are assigned
+        for box in boxes.values():
+            state.register_box(box)
+        
+        # the expected number of agents in each box: their home teams
+        weights = [0] * len(state.box_list)
+        
+        for team in teams:
+            weights[state.register_box(team.homeBox)] += len(team.agent_idxs)
+        
+        rad = config["infection"]["radius"]
+        
+        self.box_part = assign_partitions(state.box_list, weights, n_parts,
+                                          rad)
+        
+        self.shm = share_state(state)
+        
+        # workers are forked: they inherit the state mapped onto the shared
+        # memory block, and their updates are seen by the main process
+        context = multiprocessing.get_context("fork")
+        
+        self.conns, self.workers = [], []
+        
+        for part in range(n_parts):
+            
+            conn, worker_conn = context.Pipe()
+            
+            worker = context.Process(target=partition_worker,
+                                     args=(part, state, self.box_part, rad,
+                                           worker_conn),
+                                     daemon=True)
+            worker.start()
+            
+            self.conns.append(conn)
+            self.workers.append(worker)
+    
+    def step(self, eval_time):
+        """
+        Move all agents along one time step and find close agents.
+        Out:
+            ia, ib, later: arrays with agent idxs of close pairs and the
+            agent (of each pair) whose box is the meeting place, ordered
+            by the pairs (independently of the partitioning)
+        """
+        for conn in self.conns:
+            conn.send(eval_time)
+        
+        ia, ib, later = map(np.concatenate,
+                            zip(*[conn.recv() for conn in self.conns]))
+        
+        lo, hi = np.minimum(ia, ib), np.maximum(ia, ib)
+        
+        order = np.lexsort((hi, lo))
+        
+        return ia[order], ib[order], later[order]
+    
+    def close(self, abort=False):
+        """
+        Stop the workers (at once if aborted) and release the shared memory.
+        """
+        for conn, worker in zip(self.conns, self.workers):
+            if abort:
+                worker.terminate()
+            else:
+                conn.send(None)
+        
+        for worker in self.workers:
+            worker.join()
+        
+        release_state(self.state, self.shm)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close(abort=exc_type is not None)
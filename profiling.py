@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file contains the per-phase profiling of the simulation loops
+(--profile option of generate_meetings.py and output_probabilities.py).
+
+Each loop step is split into named phases which are timed with the
+wall clock, and counters (e.g. meetings per step) are summed up along. A
+summary line is printed periodically above the progress bar, and the whole
+report is saved as JSON at the end. Without --profile a NullProfiler with
+the same interface and no work is used, so the loops stay the same.
+"""
+import json
+import os
+import time
+from tqdm import tqdm
+
+# seconds of wall time between the periodic summary lines
+REPORT_EVERY = 60
+
+
+class Phase():
+    
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+    
+    def __enter__(self):
+        self.time_zero = time.perf_counter()
+    
+    def __exit__(self, exc_type, exc, tb):
+        
+        elapsed = time.perf_counter() - self.time_zero
+        
+        times = self.profiler.times
+        calls = self.profiler.calls
+        
+        times[self.name] = times.get(self.name, 0.0) + elapsed
+        calls[self.name] = calls.get(self.name, 0) + 1
+
+
+class Profiler():
+    
+    # counters are collected only if the profiler is enabled, so that the
+    # code can skip computing them otherwise
+    enabled = True
+    
+    def __init__(self, report_every=REPORT_EVERY):
+        """
+        - report_every is the number of seconds between the summary lines
+        """
+        self.report_every = report_every
+        
+        self.times  = dict() # key: phase name, val: seconds spent
+        self.calls  = dict() # key: phase name, val: number of runs
+        self.counts = dict() # key: counter name, val: sum
+        
+        self.steps = 0
+        
+        self.time_zero = self.last_report = time.perf_counter()
+        
+        # phase objects are reused, as phases repeat every step
+        self.phases = dict()
+    
+    def phase(self, name):
+        """
+        Out:
+            context manager timing its block as the phase name
+        """
+        if name not in self.phases:
+            self.phases[name] = Phase(self, name)
+        
+        return self.phases[name]
+    
+    def timed(self, iterable, name):
+        """
+        Out:
+            generator of the items of iterable, the time spent waiting for
+            each next item is counted as the phase name
+        """
+        iterator = iter(iterable)
+        
+        phase = self.phase(name)
+        
+        while True:
+            
+            with phase:
+                item = next(iterator, StopIteration)
+            
+            if item is StopIteration:
+                return
+            
+            yield item
+    
+    def count(self, name, n=1):
+        
+        self.counts[name] = self.counts.get(name, 0) + int(n)
+    
+    def step(self):
+        """
+        Count the end of a loop step, print the summary line if it is time.
+        """
+        self.steps += 1
+        
+        now = time.perf_counter()
+        
+        if now - self.last_report >= self.report_every:
+            
+            self.last_report = now
+            
+            tqdm.write(self.summary())
+    
+    def summary(self):
+        """
+        Out:
+            one line with the shares of the phases and the counters per step
+        """
+        wall = time.perf_counter() - self.time_zero
+        
+        phases = sorted(self.times.items(), key=lambda item: -item[1])
+        
+        line = [f"[profile] {wall:.0f} s, {self.steps} steps:"]
+        
+        line += [f"{name} {seconds/wall*100:.0f}%"
+                 for name, seconds in phases]
+        
+        line += [f"{name}/step {total/max(self.steps, 1):.1f}"
+                 for name, total in self.counts.items()]
+        
+        return " ".join(line)
+    
+    def report(self):
+        """
+        Out:
+            dict with the totals of all phases and counters
+        """
+        wall = time.perf_counter() - self.time_zero
+        
+        steps = max(self.steps, 1)
+        
+        return {
+            "wall_seconds": wall,
+            "steps"       : self.steps,
+            "phases"      : {name: {"seconds" : seconds,
+                                    "fraction": seconds / wall,
+                                    "calls"   : self.calls[name]}
+                             for name, seconds in self.times.items()},
+            "counters"    : {name: {"total"   : total,
+                                    "per_step": total / steps}
+                             for name, total in self.counts.items()}}
+    
+    def save(self, path):
+        
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        
+        with open(path, 'w') as file:
+            json.dump(self.report(), file, indent=4)
+        
+        tqdm.write(self.summary())
+        print(path)
+
+
+class NullPhase():
+    
+    def __enter__(self):
+        pass
+    
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+class NullProfiler():
+    
+    enabled = False
+    
+    _phase = NullPhase()
+    
+    def phase(self, name):
+        return self._phase
+    
+    def timed(self, iterable, name):
+        return iterable
+    
+    def count(self, name, n=1):
+        pass
+    
+    def step(self):
+        pass
+    
+    def save(self, path):
+        pass
+
+
+# shared default of the functions which take a profiler
+NULL_PROFILER = NullProfiler()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file contains the OpenGL rendering of the meetings generation (the
+window of generate_meetings.py). It is imported only when the window is
+shown, so headless runs do not need PyOpenGL.
+"""
+import numpy as np
+import OpenGL.GL.shaders
+from OpenGL.GL import GL_VERTEX_SHADER, GL_FRAGMENT_SHADER
+
+def compile_shader():
+    """
+    Agents are drawn instanced: init_pos is a vertex of the marker template,
+    inst_pos and inst_color are per instance (agent) attributes, so all
+    markers of one shape are drawn with one call. The outline uniform
+    switches the instances to black for drawing the marker outlines.
+    """
+    VERTEX_SHADER = """
+        
+        attribute vec2 init_pos;
+        attribute vec2 inst_pos;
+        attribute vec4 inst_color;
+        uniform float outline;
+        varying vec4 color;
+        
+        void main() {
+          gl_Position = vec4(init_pos + inst_pos, 0.0, 1.0);
+          color = mix(inst_color, vec4(0.0, 0.0, 0.0, 1.0), outline);
+        }
+    """
+
+    FRAGMENT_SHADER = """
+        
+        varying vec4 color;
+        
+        void main() {
+          gl_FragColor = color;
+        }
+
+    """
+
+    shader = OpenGL.GL.shaders.compileProgram(
+        OpenGL.GL.shaders.compileShader(   VERTEX_SHADER,
+                                        GL_VERTEX_SHADER),
+        OpenGL.GL.shaders.compileShader(   FRAGMENT_SHADER,
+                                        GL_FRAGMENT_SHADER))
+    return shader
+
+def generate_map(boxes, config):
+    canvas = {"top"    : 0,
+              "bottom" : 0,
+              "right"  : 0,
+              "left"   : 0}
+    for box in boxes.values():
+        if box.top    > canvas[   "top"]:
+            canvas[   "top"] = box.top
+        if box.bottom < canvas["bottom"]:
+            canvas["bottom"] = box.bottom
+        if box.right  > canvas[ "right"]:
+            canvas[ "right"] = box.right
+        if box.left   < canvas[  "left"]:
+            canvas[  "left"] = box.left
+    
+    canvas[ "width"] = canvas["right"] - canvas["left"]
+    canvas["height"] = canvas["top"] - canvas["bottom"]
+    
+    # 24 verticies for plotting each box (4*2 tringles, 3 vert. per triangle) 
+    fences_verts = np.zeros(24*len(boxes), [("poles", np.float32, 2)])
+    
+    # get relative position for each vertex and load in corresponding
+    for i, box in enumerate(boxes.values()):              # memory placeholder
+        # relative coords (openGL uses relative coordinates)
+        r = box.right  / canvas["width"] # between  0..1
+        r = 2*r - 1                      # between -1..1
+        l = box.left   / canvas["width"]
+        l = 2*l - 1
+        t = box.top    / canvas["height"]
+        t = 2*t - 1
+        b = box.bottom / canvas["height"]
+        b = 2*b - 1
+        # leave a bit of blank space at the plot border
+        r, l, t, b = 0.99*r, 0.99*l, 0.99*t, 0.99*b
+    
+        tx = 1/(config["window"][ "width"]/2) # box border thickness: 
+        ty = 1/(config["window"]["height"]/2) # 1 px
+    
+        fences_verts["poles"][i*24 : (i+1)*24] = (
+            # left border
+            (l, t), (l+tx, b), (l+tx, t),
+            (l, t), (l+tx, b), (l,    b),
+            # top border
+            (l, t-ty), (r, t), (l,    t),
+            (l, t-ty), (r, t), (r, t-ty),
+            # right border
+            (r-tx, t), (r, b), (r,    t),
+            (r-tx, t), (r, b), (r-tx, b),
+            # bottom border
+            (l, b), (r, b+ty), (l, b+ty),
+            (l, b), (r, b+ty), (r,    b),
+        )
+        
+    return fences_verts, canvas
+
+
+def generate_agents_verticies(config):
+    
+    agents_verts = np.zeros(3*3, [("verticies", np.float32, 2)])
+    
+    # templates for agent marker shapes
+    marker_size  = config["markerSize"]
+    w = config["window"][ "width"]
+    h = config["window"]["height"]
+    aspect_ratio = w/h
+    
+    m_w = marker_size / aspect_ratio
+    m_h = marker_size * np.sqrt(3)/2
+    
+    # triangle verticies
+    civ_templ = ((   0, m_h), 
+                 (-m_w,-m_h), 
+                 ( m_w,-m_h))
+    
+    # upside-down triangle verticies
+    mil_templ = ((-m_w, m_h),
+                 (   0,-m_h),
+                 ( m_w, m_h))
+    
+    agents_verts["verticies"][0:3] = civ_templ
+    agents_verts["verticies"][3:6] = mil_templ
+    # There is some bug in OpenGL library that prevents proper outline drawing
+    # unless the following line is included (probably the bug has to do with 
+    # offsets matching between numpy buffer and GL values parsing).
+    agents_verts["verticies"][6:9] = mil_templ
+    
+    return agents_verts
+
+
+# per instance attributes of the agent markers
+INSTANCE_DTYPE = np.dtype([( "pos" , np.float32, 2),
+                           ("color", np.float32, 4)])
+
+# marker fillings of agents close to somebody and of the others
+NEAR_COLOR = (1.0, 0.0, 0.051, 1.0)
+FAR_COLOR  = (1.0, 1.0, 1.0, 1.0)
+
+
+def agents_instances(conscripted):
+    """
+    Args:
+        conscripted: sequence of the conscripted flags of all agents
+    Out:
+        order: agent idxs with civilians first, so that each marker shape is
+               one contiguous run of instances
+        n_civilians: number of civilian instances at the start
+        instances: array of INSTANCE_DTYPE records to be filled in each frame
+    """
+    conscripted = np.asarray(conscripted, dtype=bool)
+    
+    order = np.argsort(conscripted, kind='stable')
+    
+    n_civilians = int(np.count_nonzero(~conscripted))
+    
+    return order, n_civilians, np.zeros(len(order), INSTANCE_DTYPE)
+
+
+def update_instances(instances, order, x, y, near, canvas):
+    """
+    Fill in the instances with the current positions and colors of agents.
+    Args:
+        instances, order: as returned by agents_instances
+        x, y: arrays with the agent positions (indexed by agent idx), meters
+        near: bool array, True for agents close to somebody
+        canvas: map extents returned by generate_map
+    """
+    # absolute to relative coordinates, meters -> fractions
+    instances["pos"][:, 0] = (x[order]/canvas[ "width"]*2 - 1)*0.99
+    instances["pos"][:, 1] = (y[order]/canvas["height"]*2 - 1)*0.99
+    
+    instances["color"] = np.where(near[order, None], NEAR_COLOR, FAR_COLOR)
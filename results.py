@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file contains the daily results of the infection calculation: the
+probabilities of being infected and immune for each agent on each day, kept
+in dense (day, agent) matrices, and the statistics computed from them.
+"""
+import numpy as np
+
+# quantiles of the daily probabilities in the summary (see daily_summary)
+QUANTILES = (0.05, 0.5, 0.95)
+
+
+class DailyResults():
+    
+    def __init__(self, conscripted, n_days):
+        """
+        - conscripted is a boolean array, True for conscript agents
+        - n_days is the expected number of days (the matrices grow if the
+          meeting table turns out to be longer)
+        """
+        self.conscripted = np.asarray(conscripted, dtype=bool)
+        
+        shape = (max(int(np.ceil(n_days)), 1), len(self.conscripted))
+        
+        # row d holds the probabilities at the beginning of day d+1
+        self.inf_p = np.zeros(shape, dtype=np.float32)
+        self.imm_p = np.zeros(shape, dtype=np.float32)
+        
+        self.n_recorded = 0 # number of days recorded so far
+    
+    def record(self, day_n, inf_p, imm_p):
+        """
+        Store a snapshot of all agents as the day_n row (days start from 1).
+        Days without any meetings in between get the previous snapshot.
+        """
+        if day_n > len(self.inf_p):
+            self._grow(day_n)
+        
+        if self.n_recorded:
+            last = self.n_recorded - 1
+            self.inf_p[self.n_recorded:day_n-1] = self.inf_p[last]
+            self.imm_p[self.n_recorded:day_n-1] = self.imm_p[last]
+        
+        self.inf_p[day_n-1] = inf_p
+        self.imm_p[day_n-1] = imm_p
+        
+        self.n_recorded = day_n
+    
+    def _grow(self, n_days):
+        
+        n_days = max(n_days, 2*len(self.inf_p))
+        
+        for name in ("inf_p", "imm_p"):
+            
+            old = getattr(self, name)
+            
+            new = np.zeros((n_days, old.shape[1]), dtype=old.dtype)
+            new[:len(old)] = old
+            
+            setattr(self, name, new)
+    
+    def stats(self, n_days):
+        """
+        Args:
+            n_days: number of the first days to compute the statistics for
+        Out:
+            dict with
+            top_inf: maximum daily average infection among all agents
+            max_inf: maximum daily average infection among conscripts
+            sum_inf: sum of the daily average infections among conscripts
+            at_peak: infection probabilities of conscripts on the (last)
+                     day with the maximum average infection
+            (all zero if no day has been recorded, i.e. an empty table)
+        """
+        if not self.n_recorded:
+            return {"top_inf" : 0.0,
+                    "max_inf" : 0.0,
+                    "sum_inf" : 0.0,
+                    "at_peak" : self.inf_p[0, self.conscripted]}
+        
+        inf = self.inf_p[:min(n_days, self.n_recorded)]
+        
+        # averages are accumulated in double precision
+        avg_all = inf.mean(axis=1, dtype=np.float64)
+        avg_mil = inf[:, self.conscripted].mean(axis=1, dtype=np.float64)
+        
+        # a table ending before n_days keeps its final state
+        pad = (0, n_days - len(inf))
+        
+        avg_all = np.pad(avg_all, pad, mode='edge')
+        avg_mil = np.pad(avg_mil, pad, mode='edge')
+        
+        # the last one of equal maximums, as a ">=" comparison over days does
+        peak = len(avg_mil) - 1 - np.argmax(avg_mil[::-1])
+        peak = min(peak, len(inf) - 1)
+        
+        return {"top_inf" : avg_all.max(),
+                "max_inf" : avg_mil[peak],
+                "sum_inf" : avg_mil.sum(),
+                "at_peak" : inf[peak, self.conscripted]}
+    
+    def daily_summary(self, quantiles=QUANTILES):
+        """
+        Per-day aggregates of the civilians ("civ") and conscripts ("mil"),
+        a compact table the figures are plotted from instead of one row per
+        day and agent.
+        Args:
+            quantiles: quantiles of the agents probabilities to include
+        Out:
+            dict of equal length columns, one row per day and group: day,
+            status and for both inf_p and imm_p the mean, the bounds of its
+            95% confidence interval and the quantiles (e.g. inf_p_q50)
+        """
+        n_days = self.n_recorded
+        
+        days = np.arange(1, n_days+1)
+        
+        # groups in the order of their first agent
+        groups = list(dict.fromkeys(self.conscripted.tolist()))
+        
+        table = {"day"    : np.tile(days, len(groups)),
+                 "status" : np.repeat(["mil" if flag else "civ"
+                                       for flag in groups], n_days)}
+        
+        for name in ("inf_p", "imm_p"):
+            
+            columns = {"mean": [], "ci_low": [], "ci_high": []}
+            columns.update({f"q{q*100:02.0f}": [] for q in quantiles})
+            
+            for flag in groups:
+                
+                p = getattr(self, name)[:n_days, self.conscripted == flag]
+                
+                mean = p.mean(axis=1, dtype=np.float64)
+                
+                # normal approximation of the 95% interval of the mean
+                if p.shape[1] > 1:
+                    sem = p.std(axis=1, ddof=1, dtype=np.float64)
+                    sem = sem / np.sqrt(p.shape[1])
+                else:
+                    sem = np.zeros(n_days)
+                
+                columns["mean"].append(mean)
+                columns["ci_low"].append(mean - 1.96*sem)
+                columns["ci_high"].append(mean + 1.96*sem)
+                
+                for q, values in zip(quantiles,
+                                     np.quantile(p, quantiles, axis=1)):
+                    columns[f"q{q*100:02.0f}"].append(values)
+            
+            for key, parts in columns.items():
+                table[f"{name}_{key}"] = np.concatenate(parts)
+        
+        return table
+
+
+def write_table(table, path):
+    """
+    Save a dict of equal length columns as a tab-separated csv.
+    """
+    with open(path, 'w') as file:
+        
+        file.write("\t".join(table)) # headline
+        
+        for row in zip(*table.values()):
+            file.write("\n" + "\t".join(map(str, row)))
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file contains the results store: one SQLite database in the
+output/stat_results folder which all output_probabilities.py processes
+write their results to, also when many of them run at once (massrun.sh,
+sweep.py, ensemble.py).
+
+Every computed config / meeting table pair is one run with its parameters
+(the config flattened into key-value rows), its per-day aggregates (the
+daily_stats.csv table) and its summary metrics (peak_sympt, had_disease,
+...). A run is written in one transaction, so the others see either the
+whole run or nothing of it. The database is in WAL mode, hence readers do
+not block the writers and the writers wait for each other only for the
+short time of a commit.
+
+Run as a script it queries and exports the stored results:
+    results_store.py                         the latest runs and metrics
+    results_store.py --tag "40x40%"          runs with matching tags only
+    results_store.py --sql "SELECT ..."      any query, tab-separated
+    results_store.py --export metrics -o m.csv
+"""
+import argparse
+from contextlib import closing
+from datetime import datetime
+import json
+import numbers
+import os
+import sqlite3
+import sys
+from parameters import evaluate
+from results import QUANTILES
+
+STORE_PATH = os.path.join("output", "stat_results", "results.sqlite")
+
+# seconds a writer waits for the others before giving up
+BUSY_TIMEOUT = 600
+
+# per-day aggregates of DailyResults.daily_summary
+DAILY_COLUMNS = [f"{name}_{key}" for name in ("inf_p", "imm_p")
+                 for key in ["mean", "ci_low", "ci_high"]
+                            + [f"q{q*100:02.0f}" for q in QUANTILES]]
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS runs (
+    run_id      INTEGER PRIMARY KEY,
+    tag         TEXT NOT NULL,
+    created     TEXT NOT NULL,
+    config_path TEXT,
+    meet_table  TEXT,
+    engine      TEXT,
+    config      TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_tag ON runs (tag);
+
+CREATE TABLE IF NOT EXISTS parameters (
+    run_id INTEGER NOT NULL REFERENCES runs ON DELETE CASCADE,
+    key    TEXT NOT NULL,
+    value  TEXT,
+    number REAL,
+    PRIMARY KEY (run_id, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS parameters_key ON parameters (key, number);
+
+CREATE TABLE IF NOT EXISTS daily (
+    run_id INTEGER NOT NULL REFERENCES runs ON DELETE CASCADE,
+    status TEXT NOT NULL,
+    day    INTEGER NOT NULL,
+    {", ".join(f"{column} REAL" for column in DAILY_COLUMNS)},
+    PRIMARY KEY (run_id, status, day)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS metrics (
+    run_id INTEGER NOT NULL REFERENCES runs ON DELETE CASCADE,
+    name   TEXT NOT NULL,
+    value  REAL,
+    PRIMARY KEY (run_id, name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS metrics_name ON metrics (name, value);
+
+CREATE VIEW IF NOT EXISTS latest_runs AS
+    SELECT * FROM runs WHERE run_id IN (SELECT max(run_id) FROM runs
+                                        GROUP BY tag);
+"""
+
+
+def open_store(path=STORE_PATH):
+    """
+    Args:
+        path: path to the database file, created if it does not exist
+    Out:
+        sqlite3 connection with the transactions managed explicitly
+    """
+    # other processes may be creating it at the same time
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None)
+    
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL") # WAL stays consistent
+    conn.execute("PRAGMA foreign_keys=ON")
+    
+    # executescript commits by itself, hence the explicit transaction
+    conn.executescript("BEGIN IMMEDIATE;" + SCHEMA + "COMMIT;")
+    
+    return conn
+
+
+class Transaction():
+    
+    def __init__(self, conn):
+        """
+        Context manager of one write transaction. The write lock is taken
+        at its beginning (BEGIN IMMEDIATE), so concurrent writers queue up
+        instead of failing to upgrade a read lock midway.
+        """
+        self.conn = conn
+    
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+    
+    def __exit__(self, exc_type, exc, tb):
+        
+        if exc_type is None:
+            self.conn.execute("COMMIT")
+        else:
+            self.conn.execute("ROLLBACK")
+
+
+def flatten(config, prefix=""):
+    """
+    Out:
+        dict of the config values with dotted keys, e.g.
+        {"infection.acute.daysMin": 3, ...}
+    """
+    flat = dict()
+    
+    for key, value in config.items():
+        
+        key = prefix + str(key)
+        
+        if isinstance(value, dict):
+            flat.update(flatten(value, key +"."))
+        else:
+            flat[key] = value
+    
+    return flat
+
+
+def parameter_row(run_id, key, value):
+    """
+    Out:
+        parameters row, with the number column filled for numbers and
+        arithmetic expressions so that runs can be selected by value
+    """
+    if isinstance(value, bool) or value is None:
+        return run_id, key, json.dumps(value), None
+    
+    try:
+        number = float(evaluate(value, key))
+    except (ValueError, TypeError):
+        number = None
+    
+    text = value if isinstance(value, str) else json.dumps(value)
+    
+    return run_id, key, text, number
+
+
+def save_run(conn, tag, config, metrics, daily, replace=False, **meta):
+    """
+    Args:
+        conn: connection from open_store
+        tag: tag of the run (config / meeting table pair)
+        config: config dict read from the yaml
+        metrics: dict of the summary metrics, non-numeric items are skipped
+        daily: table of DailyResults.daily_summary
+        replace: delete the stored runs with the same tag first
+        meta: config_path, meet_table and engine of the run
+    Out:
+        run_id of the stored run
+    """
+    columns = ["status", "day"] + DAILY_COLUMNS
+    
+    with Transaction(conn):
+        
+        if replace:
+            conn.execute("DELETE FROM runs WHERE tag = ?", (tag,))
+        
+        run_id = conn.execute(
+            """INSERT INTO runs (tag, created, config_path, meet_table,
+                                 engine, config)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            (tag, datetime.now().isoformat(timespec='seconds'),
+             meta.get("config_path"), meta.get("meet_table"),
+             meta.get("engine"), json.dumps(config))).lastrowid
+        
+        conn.executemany(
+            "INSERT INTO parameters VALUES (?, ?, ?, ?)",
+            [parameter_row(run_id, key, value)
+             for key, value in flatten(config).items()])
+        
+        rows = zip(*[daily[column] for column in columns])
+        
+        conn.executemany(
+            f"""INSERT INTO daily (run_id, {", ".join(columns)})
+                VALUES ({", ".join("?" * (len(columns)+1))})""",
+            [(run_id, str(status), int(day), *map(float, values))
+             for status, day, *values in rows])
+        
+        conn.executemany(
+            "INSERT INTO metrics VALUES (?, ?, ?)",
+            [(run_id, name, float(value)) for name, value in metrics.items()
+             if isinstance(value, numbers.Real)])
+    
+    return run_id
+
+
+def query_metrics(conn, tag=None, latest=True):
+    """
+    Args:
+        tag: LIKE pattern of the run tags, all runs if None
+        latest: only the latest run of each tag
+    Out:
+        (column names, rows) with one row per run: run_id, tag, created and
+        all metrics as columns
+    """
+    names = [row[0] for row in conn.execute(
+        "SELECT DISTINCT name FROM metrics ORDER BY name")]
+    
+    runs = "latest_runs" if latest else "runs"
+    
+    where, params = ("WHERE tag LIKE ?", (tag,)) if tag else ("", ())
+    
+    pivot = "".join(", max(CASE WHEN m.name = ? THEN m.value END)"
+                    for name in names)
+    
+    cursor = conn.execute(
+        f"""SELECT r.run_id, r.tag, r.created{pivot}
+            FROM {runs} AS r LEFT JOIN metrics AS m USING (run_id)
+            {where}
+            GROUP BY r.run_id ORDER BY r.tag, r.run_id""",
+        (*names, *params))
+    
+    return ["run_id", "tag", "created"] + names, cursor.fetchall()
+
+
+def query_table(conn, table, tag=None, latest=True):
+    """
+    Args:
+        table: "runs", "parameters", "daily" or "metrics" (the metrics as
+               one row per run, see query_metrics)
+        tag, latest: which runs, see query_metrics
+    Out:
+        (column names, rows) of the table rows of the runs, with their tags
+    """
+    if table == "metrics":
+        return query_metrics(conn, tag, latest)
+    
+    runs = "latest_runs" if latest else "runs"
+    
+    where, params = ("WHERE r.tag LIKE ?", (tag,)) if tag else ("", ())
+    
+    if table == "runs":
+        query = f"SELECT * FROM {runs} AS r {where} ORDER BY r.tag, r.run_id"
+    else:
+        query = f"""SELECT r.tag, t.* FROM {table} AS t
+                    JOIN {runs} AS r USING (run_id)
+                    {where} ORDER BY r.tag, t.run_id"""
+    
+    cursor = conn.execute(query, params)
+    
+    return [column[0] for column in cursor.description], cursor.fetchall()
+
+
+def write_rows(columns, rows, file):
+    """
+    Write rows as a tab-separated csv (NULL values as empty fields).
+    """
+    file.write("\t".join(columns)) # headline
+    
+    for row in rows:
+        file.write("\n" + "\t".join("" if value is None else str(value)
+                                     for value in row))
+    
+    file.write("\n")
+
+
+def parse_args(argv=None):
+    
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--store', default=STORE_PATH,
+                        help='Path to the results database')
+    parser.add_argument('--tag', default=None,
+                        help='Runs with tags matching this SQL LIKE pattern \
+                              only, e.g. "40x40%%"')
+    parser.add_argument('--all-runs', action='store_true',
+                        help='Include the earlier runs of the same tags, not \
+                              just the latest one of each tag')
+    parser.add_argument('--export', default='metrics',
+                        choices=['runs', 'parameters', 'daily', 'metrics'],
+                        help='Table to print or save (metrics: one row per \
+                              run with all metrics as columns)')
+    parser.add_argument('--sql', default=None,
+                        help='Run this query instead of exporting a table \
+                              (tables: runs, parameters, daily, metrics, \
+                              view latest_runs)')
+    parser.add_argument('-o', '--output', default=None,
+                        help='Save to this tab-separated csv file instead \
+                              of printing')
+    
+    return parser.parse_args(argv)
+
+
+def main(args):
+    
+    if not os.path.exists(args.store):
+        print(f"No results store at {args.store}, run output_probabilities.py "
+              "first.")
+        sys.exit(1)
+    
+    with closing(open_store(args.store)) as conn:
+        
+        if args.sql:
+            cursor = conn.execute(args.sql)
+            columns = [column[0] for column in cursor.description or []]
+            rows = cursor.fetchall()
+        else:
+            columns, rows = query_table(conn, args.export, args.tag,
+                                        latest=not args.all_runs)
+    
+    if args.output:
+        with open(args.output, 'w') as file:
+            write_rows(columns, rows, file)
+        print(args.output)
+    else:
+        write_rows(columns, rows, sys.stdout)
+
+
+if __name__ == "__main__":
+    main(parse_args())
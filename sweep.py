@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This script runs all configs of the configs_to_run folder on a pool of
+worker processes (it is what massrun.sh runs).
+
+Configs in configs_to_run/spatial get both the meetings generation and the
+infection calculation. Configs in configs_to_run/infection get only the
+infection calculation, upon one existing meetings table. That table is
+decoded only once into an uncompressed copy, which all workers memory-map:
+the decoded records are shared by the workers through the page cache
+instead of being decompressed and held by each of them.
+
+Every job runs in a fresh worker process, so its peak memory use can be
+accounted for. Job times and peak memory are saved to
+output/stat_results/sweep_jobs.csv.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import glob
+import multiprocessing
+import numpy as np
+import os
+import resource
+import time
+import generate_meetings
+from meet_table import decode_table
+import output_probabilities
+from parsing import config_tag
+
+
+def parse_args(argv=None):
+    
+    parser = argparse.ArgumentParser()
+    parser.add_argument('workers', type=int, nargs='?',
+                        default=os.cpu_count(),
+                        help='Number of worker processes (jobs at once)')
+    parser.add_argument('--table', default='40x40',
+                        help='Tag of the meetings table used for the configs \
+                              in configs_to_run/infection')
+    parser.add_argument('--configs', default='configs_to_run',
+                        help='Folder with the spatial and infection folders')
+    parser.add_argument('--spatial-engine', default='objects',
+                        choices=['objects','arrays'],
+                        help='--engine option of generate_meetings.py')
+    parser.add_argument('--spatial-index', default='sweep',
+                        choices=['sweep','grid'],
+                        help='--spatial-index option of generate_meetings.py')
+    parser.add_argument('--infection-engine', default='objects',
+                        choices=['objects','arrays'],
+                        help='--engine option of output_probabilities.py')
+    parser.add_argument('--no-plots', action='store_true',
+                        help='Write the statistics only, without the figures \
+                              (--no-plots option of output_probabilities.py)')
+    
+    return parser.parse_args(argv)
+
+
+def find_table(tag):
+    
+    tables = sorted(glob.glob(os.path.join(
+        "output", "meetings_tables", "meet_table_"+ tag +".bin*")))
+    
+    # unfinished tables are still being written
+    tables = [path for path in tables if not path.endswith(".part")]
+    
+    return tables[0] if tables else None
+
+
+def run_job(kind, config_path, table_path, args):
+    """
+    Worker process entry: run one job and measure it.
+    Args:
+        kind: "spatial" (generation and infection) or "infection"
+        table_path: meetings table for the infection jobs
+    Out:
+        dict with the job statistics
+    """
+    time_zero = time.time()
+    
+    # workers are forked from one server process, fresh entropy makes the
+    # runs independent (as separate interpreters would be)
+    np.random.seed()
+    
+    if kind == "spatial":
+        
+        gen_args = generate_meetings.parse_args([
+            '--no-visual', '--config', config_path,
+            '-n', config_tag(config_path),
+            '--engine', args.spatial_engine,
+            '--spatial-index', args.spatial_index,
+            '--threads', '1'])
+        
+        _, table_path = generate_meetings.main(gen_args)
+    
+    # the jobs run in parallel already, the figures of a job are plotted
+    # in its own process
+    inf_args = output_probabilities.parse_args([
+        '--config', config_path, '--meet-table', table_path,
+        '--engine', args.infection_engine, '--fig-workers', '0']
+        + (['--no-plots'] if args.no_plots else []))
+    
+    [stats] = output_probabilities.main(inf_args)
+    
+    # the worker runs a single job, hence its peak is the peak of the job
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss # KiB
+    
+    return {"tag"        : config_tag(config_path),
+            "kind"       : kind,
+            "seconds"    : time.time() - time_zero,
+            "peak_rss_mb": peak_rss / 1024,
+            "peak_sympt" : stats["peak_sympt"],
+            "had_disease": stats["had_disease"]}
+
+
+def run_jobs(jobs, args, log):
+    """
+    Run (kind, config_path, table_path) jobs on the worker pool.
+    """
+    # a forkserver with the modules preloaded starts workers without
+    # repeating the imports, each worker is used for one job only
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["generate_meetings",
+                                    "output_probabilities"])
+    
+    with ProcessPoolExecutor(args.workers, mp_context=context,
+                             max_tasks_per_child=1) as pool:
+        
+        futures = {pool.submit(run_job, *job, args): job for job in jobs}
+        
+        for future in as_completed(futures):
+            
+            kind, config_path, _ = futures[future]
+            
+            try:
+                job = future.result()
+            except Exception as e:
+                print(f"Job {kind} {config_path} failed: {e!r}")
+                continue
+            
+            print((f"Job {job['kind']} {job['tag']} done in"
+                   f" {job['seconds']:.0f} s, peak memory"
+                   f" {job['peak_rss_mb']:.0f} MB"))
+            
+            log.write("\n" + "\t".join(str(job[key]) for key in job))
+            log.flush()
+
+
+def main(args):
+    
+    spatial   = sorted(glob.glob(os.path.join(args.configs, "spatial",
+                                              "*.yaml")))
+    infection = sorted(glob.glob(os.path.join(args.configs, "infection",
+                                              "*.yaml")))
+    
+    out_stats = os.path.join("output", "stat_results")
+    if not os.path.exists(out_stats):
+        os.makedirs(out_stats)
+    
+    log_path = os.path.join(out_stats, "sweep_jobs.csv")
+    
+    with open(log_path, 'w') as log:
+        
+        log.write("tag\tkind\tseconds\tpeak_rss_mb\tpeak_sympt\thad_disease")
+        
+        """
+        Vary the spatial config part, keep infection params the same
+        """
+        run_jobs([("spatial", path, None) for path in spatial], args, log)
+        
+        """
+        Vary infection params, keep the spatial config (meetings table) the
+        same. The table is decoded once and shared by all jobs.
+        """
+        if not infection:
+            return
+        
+        table_path = find_table(args.table)
+        
+        if table_path is None:
+            print(f"No meetings table with the tag \"{args.table}\" found")
+            return
+        
+        decoded_dir = os.path.join("output", "decoded_tables")
+        if not os.path.exists(decoded_dir):
+            os.makedirs(decoded_dir)
+        
+        decoded_path = os.path.join(decoded_dir,
+                                    "meet_table_"+ args.table +".bin")
+        
+        # the decoded copy is reused while it is newer than the table
+        if (not os.path.exists(decoded_path)
+            or os.path.getmtime(decoded_path) < os.path.getmtime(table_path)):
+            
+            print(f"Decoding {table_path}")
+            decode_table(table_path, decoded_path)
+        
+        run_jobs([("infection", path, decoded_path) for path in infection],
+                 args, log)
+    
+    print(log_path)
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -3,8 +3,14 @@
 """
 This file contains functions 
 """
-from llist import dllist
 import numpy as np
+from profiling import NULL_PROFILER
+
+try:
+    # only the per-agent "objects" engine keeps agents in a linked list
+    from llist import dllist
+except ImportError:
+    dllist = None
 
 def rotate_teams(entities, stay_chance, eval_time, dt):
     """
@@ -141,9 +147,48 @@ def increment_agent_positions(agents):
         agent.y = y + agent.dy;
 
 
-def x_sort(dl):
+def increment_state_positions(state, idx=None):
+    """
+    Vectorized counterpart of increment_agent_positions for agents stored in
+    a SpatialState (the "arrays" engine). Same bounce-off-walls rule, applied
+    to all agents at once, or only to the agents idx (an array) if given.
+    """
+    if idx is not None:
+        
+        x,  y  = state.x[idx],  state.y[idx]
+        dx, dy = state.dx[idx], state.dy[idx]
+        
+        x_next = x + dx
+        y_next = y + dy
+        
+        out_x = ~((state.left[idx]   < x_next) & (x_next < state.right[idx]))
+        out_y = ~((state.bottom[idx] < y_next) & (y_next < state.top[idx]  ))
+        
+        dx[out_x] = -dx[out_x]
+        dy[out_y] = -dy[out_y]
+        
+        state.dx[idx], state.dy[idx] = dx, dy
+        state.x[idx],  state.y[idx]  = x + dx, y + dy
+        
+        return
+    
+    x_next = state.x + state.dx
+    y_next = state.y + state.dy
+    
+    out_x = ~((state.left   < x_next) & (x_next < state.right))
+    out_y = ~((state.bottom < y_next) & (y_next < state.top  ))
+    
+    np.negative(state.dx, out=state.dx, where=out_x)
+    np.negative(state.dy, out=state.dy, where=out_y)
+    
+    state.x += state.dx
+    state.y += state.dy
+
+
+def x_sort(dl, profiler=NULL_PROFILER):
     """
     Sorts the doubly linked list of agents (dl) along the x-ordinate
+    (profiler counts the moved agents as "sort_moves")
     """
     n = dl.nodeat(0) # node
     nn = n.next      # next node
@@ -162,6 +207,7 @@ def x_sort(dl):
             if not nb: # if the list start is reached, just insert there
                 e = dl.remove(n) # e: element stored within the node
                 dl.appendleft(e)
+                profiler.count("sort_moves")
                 break
             
             if not dis: # if things are already ok 
@@ -173,6 +219,7 @@ def x_sort(dl):
             if nb.value.x < n.value.x: # proper position is found, insert here
                 e = dl.remove(n)
                 dl.insert(e, nb.next)
+                profiler.count("sort_moves")
                 break
             
             nb = nb.prev
@@ -180,7 +227,7 @@ def x_sort(dl):
     return dl
 
 
-def initial_sort(agents):
+def initial_sort(agents, order=None):
     """
     Perform an initial sort of agents along the x-ordinate (later such sorted
     list is needed for a bit faster neighbours finding computation). Since
@@ -188,10 +235,20 @@ def initial_sort(agents):
     numpy quicksort appears to be an optimal choice. 
     Args:
         agents: list with references to (spatial) agents instances
+        order: agent idxs in the x-order to restore (e.g. from a checkpoint)
+               instead of sorting
     Out:
         dl: sorted doubly linked list with references to agents instances
     """
     
+    if dllist is None:
+        raise ImportError(("The llist package is required for the sweep over"
+                           " agent objects. Install it or use the 'arrays'"
+                           " engine which keeps the x-order in numpy."))
+    
+    if order is not None:
+        return dllist([agents[idx] for idx in order])
+    
     IX = [] # list of indexes and positions along the x-ordinate
     
     for agent in agents: IX.append([agent.idx, agent.x])
@@ -207,26 +264,77 @@ def initial_sort(agents):
     return dl
 
 
-def detect_meetings(agents_x_sorted, eval_time, config, visualize):
+def initial_order(state):
+    """
+    Numpy counterpart of initial_sort for agents stored in a SpatialState.
+    The x-ordering is kept as a permutation array of agent idxs in state.order
+    Args:
+        state: SpatialState of agents
+    Out:
+        state.order: agent idxs sorted along the x-ordinate
+    """
+    state.order = np.argsort(state.x)
+    
+    state.n_transferred = 0 # agents teleported since the last sort
+    
+    return state.order
+
+
+def x_sort_order(state, full_sort_fraction=0.1, profiler=NULL_PROFILER):
+    """
+    Numpy counterpart of x_sort. Between two steps agents move only a bit,
+    so the previous permutation is nearly sorted and a stable sort (timsort)
+    of it runs in almost linear time. After mass transfers (team rotations,
+    sotilaskoti queue) many agents are teleported to random positions and a
+    full quicksort from scratch is cheaper.
+    Args:
+        state: SpatialState of agents with the state.order from previous step
+        full_sort_fraction: fraction of transferred agents above which the
+                            order is rebuilt from scratch
+        profiler: counts the agents which changed their place in the order
+                  as "sort_moves"
+    Out:
+        state.order: refreshed permutation
+    """
+    previous = state.order
+    
+    if state.n_transferred > full_sort_fraction * len(state.order):
+        
+        state.order = np.argsort(state.x)
+        
+        profiler.count("sort_rebuilds")
+    else:
+        resort = np.argsort(state.x[state.order], kind='stable')
+        
+        state.order = state.order[resort]
+    
+    if profiler.enabled:
+        profiler.count("sort_moves", np.count_nonzero(state.order != previous))
+    
+    state.n_transferred = 0
+    
+    return state.order
+
+
+def detect_meetings(agents_x_sorted, eval_time, config,
+                    profiler=NULL_PROFILER):
     """
     Args:
         agents: list with agents objects
         eval_time: time in seconds elapsed from the simulation start
         config: config read from the yaml
+        profiler: counts pairs checked for the distance as "candidates"
     Out:
-        meets_curr: set of frozensets
+        meets_curr: (links, places) tuple of arrays, see link_meetings
         Contains info about close agents at this step of the simulation. Each
-        frozenset contains two numbers - indexes of agents that form one 
+        link is one number made of the indexes of two agents that form one 
         connection. 
     """
-    if visualize:
-        for agent in agents_x_sorted:
-            agent.color = (1.0, 1.0, 1.0, 0.0)
-    
-    
     rad = config["infection"]["radius"]
     
-    meets_curr = dict()
+    ia, ib, places = [], [], []
+    
+    scanned = 0 # pairs closer than the radius along the x-ordinate
     
     n = agents_x_sorted.nodeat(0) # node (contains the reference agent)
     nn = n.next                   # next node (contains the following agent)
@@ -245,6 +353,8 @@ def detect_meetings(agents_x_sorted, eval_time, config, visualize):
             
             if dx < rad:
                 
+                scanned += 1
+                
                 dy = n.value.y - nb.value.y
                 
                 dist = (dx*dx + dy*dy)**0.5
@@ -259,21 +369,23 @@ def detect_meetings(agents_x_sorted, eval_time, config, visualize):
         
         for near in nears:
             
-            link  = frozenset({n.value.idx, near.idx}) # who with who
-            place = n.value.allowed_box.name # where
-            
-            meets_curr[link] = place
-            
-        # paint agents within a Euclidean circle red
-        if visualize:
-            color = (1.0, 0.0, 0.051, 1.0)
-            if nears: n.value.color = color
-            
-            for near in nears:
-                near.color = color
-            
-            
-    return meets_curr
+            ia.append(n.value.idx) # who with who
+            ib.append(near.idx)
+            places.append(n.value.allowed_box.name) # where
+    
+    profiler.count("candidates", scanned)
+    
+    return link_meetings(np.array(ia, dtype=np.int64),
+                         np.array(ib, dtype=np.int64),
+                         np.array(places, dtype=object), len(agents_x_sorted))
+
+
+
+
+
+
+
+
 
 
 
@@ -289,9 +401,249 @@ def detect_meetings(agents_x_sorted, eval_time, config, visualize):
 
 
 
+def expand_ranges(p, lo, hi):
+    """
+    Expand index ranges into flat pairs: for every i, pairs (p[i], j) with
+    lo[i] <= j < hi[i]. Empty and negative ranges yield no pairs.
+    """
+    counts = np.clip(hi - lo, 0, None)
+    
+    a = np.repeat(p, counts)
+    
+    # position of each pair within its range, shifted by the range start
+    shift = np.repeat(lo - np.cumsum(counts) + counts, counts)
+    b = shift + np.arange(counts.sum())
+    
+    return a, b
+
+
+def grid_close_pairs(x, y, rad, profiler=NULL_PROFILER):
+    """
+    Uniform grid (cell list) neighbour search. Agents are binned into square
+    cells of size rad, hence a close neighbour can only be found in the same
+    or in one of the adjacent cells. Each unordered pair of cells is visited
+    once: the cell itself plus four of its eight neighbours.
+    Args:
+        x, y: numpy arrays with agent positions
+        rad: meeting radius
+        profiler: counts pairs checked for the distance as "candidates"
+    Out:
+        ia, ib: arrays with indexes of agents closer than rad to each other
+    """
+    if len(x) < 2:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    
+    cx = np.floor(x / rad).astype(np.int64)
+    cy = np.floor(y / rad).astype(np.int64)
+    
+    # non-negative cell coordinates with a spare row on both sides, so that
+    # neighbour keys (cy-1, cy+1) never wrap around to another column
+    cx -= cx.min()
+    cy -= cy.min() - 1
+    ny = cy.max() + 2
+    
+    key = cx * ny + cy # cell id
+    
+    order = np.argsort(key, kind='stable') # agents grouped by cells
+    skey = key[order]
+    
+    cells, starts, counts = np.unique(skey, return_index=True,
+                                            return_counts=True)
+    ends = starts + counts
+    
+    pos = np.arange(len(skey)) # position of agent in the cell-sorted order
+    
+    ia, ib = [], []
+    
+    for dcx, dcy in ((0, 0), (0, 1), (1, -1), (1, 0), (1, 1)):
+        
+        if (dcx, dcy) == (0, 0):
+            # within own cell: only agents that follow in the cell order
+            lo = pos + 1
+            hi = ends[np.searchsorted(cells, skey)]
+        else:
+            nkey = skey + dcx*ny + dcy
+            
+            loc = np.minimum(np.searchsorted(cells, nkey), len(cells) - 1)
+            
+            found = cells[loc] == nkey
+            
+            lo = np.where(found, starts[loc], 0)
+            hi = np.where(found,   ends[loc], 0)
+        
+        a, b = expand_ranges(pos, lo, hi)
+        
+        ia.append(order[a])
+        ib.append(order[b])
+    
+    ia = np.concatenate(ia)
+    ib = np.concatenate(ib)
+    
+    profiler.count("candidates", len(ia))
+    
+    dx = x[ia] - x[ib]
+    dy = y[ia] - y[ib]
+    
+    close = np.sqrt(dx*dx + dy*dy) < rad
+    
+    return ia[close], ib[close]
+
+
+def detect_meetings_grid(agents, eval_time, config, state=None,
+                         profiler=NULL_PROFILER):
+    """
+    Same as detect_meetings, but the neighbours are found with a uniform grid
+    of cells instead of the sweep along the x-sorted list. Therefore, the
+    cost scales with the number of close pairs rather than with the x-overlap
+    of agents (e.g. in tall and narrow boxes).
+    Args:
+        agents: list with agents objects
+        eval_time: time in seconds elapsed from the simulation start
+        config: config read from the yaml
+        state: SpatialState of agents for the "arrays" engine (optional)
+        profiler: counts pairs checked for the distance as "candidates"
+    Out:
+        meets_curr: (links, places) tuple of arrays, the same as the one
+        returned by detect_meetings.
+    """
+    rad = config["infection"]["radius"]
+    
+    if state is not None:
+        x, y = state.x, state.y
+    else:
+        x = np.fromiter((agent.x for agent in agents), float, len(agents))
+        y = np.fromiter((agent.y for agent in agents), float, len(agents))
+    
+    ia, ib = grid_close_pairs(x, y, rad, profiler)
+    
+    # the place is the box of the agent that is further along the x-ordinate
+    # (as in the sweep, where it is the one found later in the sorted list)
+    later = np.where(x[ia] >= x[ib], ia, ib)
+    
+    return pairs_to_meetings(agents, ia, ib, later, state)
+
+
+def detect_meetings_sorted(agents, eval_time, config, state,
+                           profiler=NULL_PROFILER):
+    """
+    Vectorized counterpart of detect_meetings for the "arrays" engine. The
+    sweep runs over the state.order permutation: for each agent the window of
+    the following agents closer than the radius along the x-ordinate is
+    found with a binary search, then Euclidean distances are checked.
+    Args:
+        agents: list with agents objects (views of the state)
+        eval_time: time in seconds elapsed from the simulation start
+        config: config read from the yaml
+        state: SpatialState of agents with the up-to-date state.order
+        profiler: counts pairs checked for the distance as "candidates"
+    Out:
+        meets_curr: (links, places) tuple of arrays, the same as the one
+        returned by detect_meetings.
+    """
+    rad = config["infection"]["radius"]
+    
+    order = state.order
+    
+    xs = state.x[order]
+    ys = state.y[order]
+    
+    pos = np.arange(len(order)) # positions in the x-sorted order
+    
+    # end of the window of agents with dx < rad
+    hi = np.searchsorted(xs, xs + rad, side='left')
+    
+    p, q = expand_ranges(pos, pos + 1, hi)
+    
+    profiler.count("candidates", len(p))
+    
+    dx = xs[q] - xs[p]
+    dy = ys[q] - ys[p]
+    
+    close = np.sqrt(dx*dx + dy*dy) < rad
+    
+    ia, ib = order[p[close]], order[q[close]]
+    
+    # as in detect_meetings, the place is the box of the agent found later
+    return pairs_to_meetings(agents, ia, ib, ib, state)
+
+
+def link_keys(ia, ib, n_agents):
+    """
+    Encode meeting links as numbers: min_idx * n_agents + max_idx. A link
+    does not depend on the order of the two agents, and sorted links can be
+    compared with array operations instead of sets of frozensets.
+    """
+    ia = np.asarray(ia, dtype=np.int64)
+    ib = np.asarray(ib, dtype=np.int64)
+    
+    return np.minimum(ia, ib) * n_agents + np.maximum(ia, ib)
+
+
+def link_agents(links, n_agents):
+    """
+    Decode links (see link_keys) back to the pairs of agent idxs.
+    Out:
+        agent_a, agent_b: arrays with the lower and the higher idx
+    """
+    return links // n_agents, links % n_agents
 
 
+def link_meetings(ia, ib, places, n_agents):
+    """
+    Args:
+        ia, ib: arrays with indexes of agents that form one connection
+        places: array with the place (box name) of each connection
+        n_agents: number of all agents
+    Out:
+        links: sorted int64 array with the links (see link_keys)
+        places: array with the place of each link
+    """
+    links = link_keys(ia, ib, n_agents)
+    
+    order = np.argsort(links, kind='stable')
+    
+    return links[order], places[order]
 
 
+def new_meetings(meets_curr, meets_prev):
+    """
+    Find meetings which did not exist at the previous step.
+    Args:
+        meets_curr, meets_prev: (links, places) tuples, see link_meetings
+    Out:
+        (links, places) tuple with the new meetings of meets_curr
+    """
+    links_curr, places_curr = meets_curr
+    links_prev, _ = meets_prev
+    
+    # both link arrays are sorted: each current link is looked up among the
+    # previous ones with a binary search
+    pos = np.searchsorted(links_prev, links_curr)
+    
+    found = np.zeros(len(links_curr), dtype=bool)
+    
+    inside = pos < len(links_prev)
+    found[inside] = links_prev[pos[inside]] == links_curr[inside]
+    
+    return links_curr[~found], places_curr[~found]
 
 
+def pairs_to_meetings(agents, ia, ib, later, state=None):
+    """
+    Convert arrays of close agent pairs to the (links, places) meetings.
+    Args:
+        agents: list with agents objects
+        ia, ib: arrays with indexes of agents that form one connection
+        later: array with the agent (of each pair) whose box is the place
+        state: SpatialState of agents for the "arrays" engine (optional)
+    Out:
+        meets_curr: (links, places) tuple of arrays, see link_meetings
+    """
+    if state is not None:
+        names = np.array([box.name for box in state.box_list], dtype=object)
+        places = names[state.box_id[later]]
+    else:
+        places = np.array([agents[i].allowed_box.name for i in later],
+                          dtype=object)
+    
+    return link_meetings(ia, ib, places, len(agents))